@@ -0,0 +1,66 @@
+'''
+Bloom filter of a service, ids certainly not in the table are answered
+from memory, string ids(e.g: url arguments) are the same as integers.
+
+usage::
+
+    python demos/bloom_service.py
+'''
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import peewee  # noqa: E402
+
+from tweb.database.model import BaseModel  # noqa: E402
+from tweb.exceptions import NotFoundError  # noqa: E402
+from tweb.service import BaseService  # noqa: E402
+from tweb.utils.bloom import BloomFilter  # noqa: E402
+
+db = peewee.SqliteDatabase(':memory:')
+
+
+class Article(BaseModel):
+    id = peewee.AutoField()
+    title = peewee.CharField()
+
+    class Meta:
+        database = db
+
+
+class Tag(BaseModel):
+    code = peewee.CharField(primary_key=True)
+
+    class Meta:
+        database = db
+
+
+def main():
+    db.create_tables([Article, Tag])
+    Article.insert_many([{'title': f'a{i}'} for i in range(100)]).execute()
+    Tag.insert_many([{'code': code} for code in ('05', 'x')]).execute()
+    articles = BaseService(Article, bloom=BloomFilter(1000, 0.001))
+    tags = BaseService(Tag, bloom=BloomFilter(1000, 0.001))
+    for service in (articles, tags):
+        # answered from the second rebuild
+        service.rebuild_bloom()
+        service.rebuild_bloom()
+
+    for pk in (5, '5', '05', ' 5', '100'):
+        assert articles.may_exist(pk), f'article {pk!r} exists'
+        assert articles.get_or_404(pk).id == int(pk)
+    assert not articles.may_exist(-3) and not articles.may_exist('-3')
+    try:
+        articles.get_or_404('-3')
+        raise AssertionError('article -3 does not exist')
+    except NotFoundError:
+        pass
+    # string primary keys are not integers, always queried
+    assert tags.may_exist('05') and tags.get_or_404('05').code == '05'
+    print('string ids are answered like integers')
+
+
+if __name__ == '__main__':
+    main()
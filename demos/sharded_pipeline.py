@@ -0,0 +1,58 @@
+'''
+Sharded redis with auto pipeline, multi-key commands queued in one
+pipeline are split by node, checked against the nodes directly.
+
+usage::
+
+    # three databases of one redis are three nodes
+    python demos/sharded_pipeline.py
+    python demos/sharded_pipeline.py redis://10.0.0.1:6379/0 \\
+        redis://10.0.0.2:6379/0
+'''
+import os
+import sys
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from tweb.cache import Cache, DictCache  # noqa: E402
+
+URLS = [f'redis://localhost:6379/{db}' for db in range(3)]
+
+
+async def check(urls: list) -> None:
+    cache = Cache(urls, model='sharded', auto_pipeline=True).initialize()
+    sharded = cache.cache.client
+    keys = [f'demo:sharded:{i}' for i in range(12)]
+    await asyncio.gather(*[cache.set(key, key) for key in keys])
+    nodes = {sharded.node_index(key) for key in keys}
+    print(f'{len(keys)} keys on {len(nodes)} of {len(urls)} nodes')
+
+    # queued in one tick, one pipeline of every node
+    values, first = await asyncio.gather(cache.mget(keys),
+                                         cache.get(keys[0]))
+    assert values == keys and first == keys[0], f'mget {values}'
+    count = await cache.delete(*keys)
+    assert count == len(keys), f'delete {count}'
+    for key in keys:
+        assert not await sharded.node(key).exists(key), f'{key} is left'
+
+    class DemoCache(DictCache):
+        __rdskey__ = 'demo:sharded:user:{0}'
+
+    DemoCache.cache = cache
+    ids = list(range(12))
+    await DemoCache.set_many({id_: {'id': id_} for id_ in ids})
+    await DemoCache.removes(*ids)
+    records = await DemoCache.get_many(ids)
+    assert records == [None] * len(ids), f'removes {records}'
+    print('mget, delete and DictCache.removes are split by node')
+
+
+def main():
+    asyncio.run(check(sys.argv[1:] or URLS))
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,8 @@ from tornado import httpclient
 from tornado import simple_httpclient
 
 from .exceptions import HTTPTimeoutError, HTTPError
-from tweb.utils.escape import json_dumps
+from tweb.utils import escape
+from tweb.utils.escape import json_dumpb
 
 
 async def request(url: str,
@@ -42,20 +43,38 @@ async def request(url: str,
         return resp
 
 
-def _build_headers(json: bool = False) -> dict:
+def _build_headers(json: bool = False, msgpack: bool = False) -> dict:
     headers = {}
     headers['Accept-Language'] = 'zh-CN,zh;q=0.9,en-GB;q=0.8,en;q=0.7'
     headers['User-Agent'] = ("Mozilla/5.0 (Windows NT 6.3; WOW64)"
                              " Chrome/82.0.3396.99 Safari/537.36")
     if json:
         headers['Content-Type'] = 'application/json'
+    if msgpack:
+        headers['Accept'] = f'{escape.MSGPACK_TYPES[0]}, application/json'
     return headers
 
 
+def decode_body(resp: httpclient.HTTPResponse) -> Any:
+    '''
+    Decode response body by Content-Type, MessagePack or json,
+    otherwise return raw body.
+    '''
+    ctype = resp.headers.get('Content-Type', '')
+    if not resp.body:
+        return None
+    if any(_type in ctype for _type in escape.MSGPACK_TYPES):
+        return escape.msgpack_loads(resp.body)
+    if 'application/json' in ctype:
+        return escape.json_loads(resp.body)
+    return resp.body
+
+
 async def post(url: str,
                data: dict = None,
                json: bool = False,
                timeout: int = None,
+               msgpack: bool = False,
                **kwargs: Any) -> Optional[tuple]:
     '''Create http post request
 
@@ -63,34 +82,45 @@ async def post(url: str,
     :param data: `<dict>`
     :param json: `<bool>`
     :param timeout: `<int>`
+    :param msgpack: `<bool>` accept MessagePack, body is decoded
     :param kwargs: `<dict>`
     :return: `<tuple>` status_code, body
     '''
     if not kwargs.get('headers'):
-        kwargs['headers'] = _build_headers(json)
-    elif json:
-        kwargs['headers']['Content-Type'] = 'application/json'
+        kwargs['headers'] = _build_headers(json, msgpack)
+    else:
+        if json:
+            kwargs['headers']['Content-Type'] = 'application/json'
+        if msgpack:
+            kwargs['headers']['Accept'] = _build_headers(
+                msgpack=True)['Accept']
     if json and data:
-        kwargs['body'] = json_dumps(data)
+        kwargs['body'] = json_dumpb(data)
     else:
         kwargs['data'] = data
     resp = await request(url, method='POST', timeout=timeout, **kwargs)
     if not resp:
         return None
-    return resp.code, resp.body
+    return resp.code, decode_body(resp) if msgpack else resp.body
 
 
-async def get(url: str, timeout: int = None, **kwargs: Any) -> Optional[tuple]:
+async def get(url: str,
+              timeout: int = None,
+              msgpack: bool = False,
+              **kwargs: Any) -> Optional[tuple]:
     '''Create http get request
 
     :param url: `<str>`
     :param timeout: `<int>`
+    :param msgpack: `<bool>` accept MessagePack, body is decoded
     :param kwargs: `<dict>`
     :return: `<tuple>` status_code, body
     '''
     if not kwargs.get('headers'):
-        kwargs['headers'] = _build_headers()
+        kwargs['headers'] = _build_headers(msgpack=msgpack)
+    elif msgpack:
+        kwargs['headers']['Accept'] = _build_headers(msgpack=True)['Accept']
     resp = await request(url, method='GET', timeout=timeout, **kwargs)
     if not resp:
         return None
-    return resp.code, resp.body
+    return resp.code, decode_body(resp) if msgpack else resp.body
@@ -1,21 +1,619 @@
+import ast
+import math
+import bisect
+import hashlib
+import time
+import zlib
+import random
+import asyncio
 import aredis
 from aredis.sentinel import Sentinel
-from typing import Any, Optional, Union, Awaitable, List
+from aredis.exceptions import ConnectionError as RedisConnectionError
+from typing import Any, Callable, Optional, Union, Awaitable, List, Iterable
 
 from .config import Config
 from .exceptions import NotFoundError
 from tweb.utils.attr_util import AttrDict
+from tweb.utils.escape import (json_dumps, json_loads, msgpack,
+                               msgpack_dumpb, msgpack_loads)
 from tweb.utils.log import logger
+from tweb.utils.lru import LRUCache
+from tweb.utils.sketch import CountMinSketch
+from tweb.utils.shm import AsyncSharedMemoryCache
+
+__all__ = [
+    'Cache', 'ShardedRedis', 'SentinelRedis', 'AutoPipeline', 'HotKeyCache',
+    'StrCache', 'DictCache', 'batch'
+]
+
+ID_TYPE = Union[int, str]
+_MISSING = object()
+# commands auto pipelined, others are sent directly
+PIPELINE_COMMANDS = frozenset([
+    'get', 'set', 'mget', 'exists', 'delete', 'expire', 'ttl', 'incr',
+    'incrby', 'decr', 'hget', 'hgetall', 'hmget', 'hmset', 'hset', 'hdel',
+    'hincrby', 'hexists', 'sismember', 'smembers', 'sadd', 'srem', 'zscore',
+    'zadd', 'zincrby', 'zrange', 'zrevrange'
+])
+# flush queued commands over it without waiting the tick
+DEF_MAX_BATCH = 1000
+# read-only commands, sent to replicas if enabled and retried on failover
+READ_COMMANDS = frozenset([
+    'get', 'mget', 'exists', 'ttl', 'hget', 'hgetall', 'hmget', 'hexists',
+    'sismember', 'smembers', 'zscore', 'zrange', 'zrevrange'
+])
+# seconds replicas are discovered again
+DEF_REPLICA_REFRESH = 30
+# virtual nodes of one redis node on the consistent-hash ring
+DEF_VNODES = 160
+# single key reads served locally when the key is hot
+HOT_READS = frozenset(['get', 'hgetall'])
+# writes drop the local copy of their keys
+HOT_WRITES = frozenset([
+    'set', 'delete', 'expire', 'incr', 'incrby', 'decr', 'hmset', 'hset',
+    'hdel', 'hincrby'
+])
+# get_or_compute polls the value every seconds while another computes
+LOCK_POLL = 0.05
+# first byte of DictCache binary value
+_RAW, _ZLIB = b'\x00', b'\x01'
+
+
+class AutoPipeline:
+    '''
+    Commands issued within one event loop tick(or window seconds) are
+    sent in one pipeline, every caller awaits its own result.
+
+    usage::
+
+        cache = Cache(url, auto_pipeline=True).initialize()
+        # 500 coroutines, one round-trip
+        await asyncio.gather(*[cache.get(f'user:{i}') for i in range(500)])
+    '''
+    def __init__(self,
+                 client: Any,
+                 window: float = 0,
+                 max_batch: int = DEF_MAX_BATCH) -> None:
+        '''
+        :param client: `<StrictRedis>` redis client
+        :param window: `<float>` seconds commands are collected,
+            0 current event loop tick
+        :param max_batch: `<int>` max commands of one pipeline
+        '''
+        self.client = client
+        self.window = window
+        self.max_batch = max_batch
+        # [(name, args, kwargs, future)]
+        self._queue = []
+        self._handle = None
+
+    def __getattr__(self, name: str) -> Any:
+        if name in PIPELINE_COMMANDS:
+            return lambda *args, **kwargs: self._enqueue(name, args, kwargs)
+        return getattr(self.client, name)
+
+    def _enqueue(self, name: str, args: tuple,
+                 kwargs: dict) -> asyncio.Future:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._queue.append((name, args, kwargs, future))
+        if len(self._queue) >= self.max_batch:
+            self._flush()
+        elif self._handle is None:
+            if self.window:
+                self._handle = loop.call_later(self.window, self._flush)
+            else:
+                self._handle = loop.call_soon(self._flush)
+        return future
+
+    def _flush(self) -> None:
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        queue, self._queue = self._queue, []
+        if queue:
+            asyncio.ensure_future(self._execute(queue))
+
+    async def _execute(self, queue: list) -> None:
+        try:
+            pipe = await self.client.pipeline(transaction=False)
+            for name, args, kwargs, _ in queue:
+                await getattr(pipe, name)(*args, **kwargs)
+            results = await pipe.execute(raise_on_error=False)
+        except Exception as err:
+            for *_, future in queue:
+                if not future.done():
+                    future.set_exception(err)
+            return
+        for (*_, future), result in zip(queue, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(
+        hashlib.md5(value.encode('utf-8')).digest()[:8], 'little')
+
+
+class ShardedRedis:
+    '''
+    Keys are spread over independent redis nodes by a consistent-hash
+    ring of virtual nodes, adding a node moves about 1/n keys. Like redis
+    cluster, only {tag} of a key is hashed if it has one. Multi-key
+    commands and pipelines are split by node and run concurrently,
+    publish/subscribe and keyless commands use the first node.
+
+    usage::
+
+        urls = ['redis://10.0.0.1:6379/0', 'redis://10.0.0.2:6379/0']
+        cache = Cache(urls, model='sharded').initialize()
+        # or config: center_redis_url = redis://..,redis://..
+        cache = Cache(conf_prefix='center', model='sharded').initialize()
+    '''
+    def __init__(self,
+                 urls: Union[str, List[str]],
+                 vnodes: int = DEF_VNODES,
+                 **kwargs: Any) -> None:
+        '''
+        :param urls: `<str/list>` redis urls, str is separated by comma
+        :param vnodes: `<int>` virtual nodes of one redis node
+        :param kwargs: `<Any>` redis connection kwargs
+        '''
+        if isinstance(urls, str):
+            urls = [url.strip() for url in urls.split(',') if url.strip()]
+        assert urls, 'sharded redis urls are empty'
+        self.urls = urls
+        self.nodes = [aredis.StrictRedis.from_url(url, **kwargs)
+                      for url in urls]
+        ring = sorted((_ring_hash(f'{url}#{i}'), index)
+                      for index, url in enumerate(urls)
+                      for i in range(vnodes))
+        self._hashes = [item[0] for item in ring]
+        self._indexes = [item[1] for item in ring]
+
+    def node_index(self, key: Any) -> int:
+        key = f'{key}'
+        start = key.find('{')
+        if start != -1:
+            end = key.find('}', start + 1)
+            if end > start + 1:
+                key = key[start + 1:end]
+        pos = bisect.bisect(self._hashes, _ring_hash(key))
+        return self._indexes[pos % len(self._indexes)]
+
+    def node(self, key: Any) -> Any:
+        return self.nodes[self.node_index(key)]
+
+    def __getattr__(self, name: str) -> Any:
+        def command(*args: Any, **kwargs: Any) -> Awaitable:
+            client = self.node(args[0]) if args else self.nodes[0]
+            return getattr(client, name)(*args, **kwargs)
+
+        if name in ('publish', 'pubsub'):
+            return getattr(self.nodes[0], name)
+        return command
+
+    def _group(self, keys: Iterable[Any]) -> dict:
+        # {node index: [(position, key)]}
+        groups = {}
+        for position, key in enumerate(keys):
+            groups.setdefault(self.node_index(key), []).append(
+                (position, key))
+        return groups
+
+    async def delete(self, *keys: str) -> int:
+        groups = self._group(keys)
+        counts = await asyncio.gather(*[
+            self.nodes[index].delete(*[key for _, key in items])
+            for index, items in groups.items()
+        ])
+        return sum(counts)
+
+    async def mget(self, keys: Iterable[str], *args: str) -> list:
+        keys = list(keys) + list(args)
+        groups = self._group(keys)
+        values = await asyncio.gather(*[
+            self.nodes[index].mget([key for _, key in items])
+            for index, items in groups.items()
+        ])
+        results = [None] * len(keys)
+        for items, node_values in zip(groups.values(), values):
+            for (position, _), value in zip(items, node_values):
+                results[position] = value
+        return results
+
+    async def flushdb(self) -> bool:
+        await asyncio.gather(*[node.flushdb() for node in self.nodes])
+        return True
+
+    async def pipeline(self, transaction: bool = False,
+                       shard_hint: Any = None) -> 'ShardedPipeline':
+        return ShardedPipeline(self)
+
+    async def transaction(self, func: Callable, *watches: str,
+                          **kwargs: Any) -> Any:
+        '''WATCH/MULTI on the node of the keys, keys must be on one node'''
+        indexes = {self.node_index(key) for key in watches}
+        assert len(indexes) <= 1, 'watched keys are on different nodes'
+        client = self.nodes[indexes.pop()] if indexes else self.nodes[0]
+        return await client.transaction(func, *watches, **kwargs)
+
+
+class ShardedPipeline:
+    '''
+    Commands are grouped by node, one pipeline of every node. Multi-key
+    commands(mget, delete) are split by node and their results merged.
+    '''
+    def __init__(self, redis: ShardedRedis) -> None:
+        self.redis = redis
+        # [(name, args, kwargs)]
+        self._stack = []
+
+    def __len__(self) -> int:
+        return len(self._stack)
+
+    def __getattr__(self, name: str) -> Any:
+        async def command(*args: Any, **kwargs: Any) -> 'ShardedPipeline':
+            self._stack.append((name, args, kwargs))
+            return self
+
+        return command
+
+    def _split(self, name: str, args: tuple) -> list:
+        '''[(node index, args, key positions)] of a command'''
+        if name == 'mget' and args:
+            keys = args[0]
+            keys = [keys] if isinstance(keys, (str, bytes)) else list(keys)
+            groups = self.redis._group(keys + list(args[1:]))
+            return [(index, ([key for _, key in items], ),
+                     [position for position, _ in items])
+                    for index, items in groups.items()]
+        if name == 'delete' and args:
+            groups = self.redis._group(args)
+            return [(index, tuple(key for _, key in items), None)
+                    for index, items in groups.items()]
+        return [(self.redis.node_index(args[0]) if args else 0, args, None)]
+
+    @staticmethod
+    def _merge(name: str, parts: list) -> Any:
+        if len(parts) == 1:
+            return parts[0][1]
+        for _, value in parts:
+            if isinstance(value, Exception):
+                return value
+        if name == 'delete':
+            return sum(value for _, value in parts)
+        # mget, values in key positions
+        results = [None] * sum(len(positions) for positions, _ in parts)
+        for positions, values in parts:
+            for position, value in zip(positions, values):
+                results[position] = value
+        return results
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        stack, self._stack = self._stack, []
+        groups = {}
+        for position, (name, args, kwargs) in enumerate(stack):
+            for index, node_args, positions in self._split(name, args):
+                groups.setdefault(index, []).append(
+                    (position, name, node_args, kwargs, positions))
+        values = await asyncio.gather(*[
+            self._execute_node(index, items)
+            for index, items in groups.items()
+        ])
+        # {position: [(key positions, value of one node)]}
+        parts = {}
+        for items, node_values in zip(groups.values(), values):
+            for item, value in zip(items, node_values):
+                parts.setdefault(item[0], []).append((item[4], value))
+        results = [
+            self._merge(name, parts[position])
+            for position, (name, _, _) in enumerate(stack)
+        ]
+        if raise_on_error:
+            for value in results:
+                if isinstance(value, Exception):
+                    raise value
+        return results
+
+    async def _execute_node(self, index: int, items: list) -> list:
+        pipe = await self.redis.nodes[index].pipeline(transaction=False)
+        for _, name, args, kwargs, _ in items:
+            await getattr(pipe, name)(*args, **kwargs)
+        return await pipe.execute(raise_on_error=False)
+
+
+class SentinelRedis:
+    '''
+    Master discovered by sentinel, a failover is found on the next
+    connection(connection error or read only master) without restart,
+    read commands are retried once. Optional read-only commands (and
+    pipelines of only them) go to replicas round-robin, replicas are
+    discovered every refresh seconds, the master serves if none.
+
+    usage::
+
+        sentinels = [('10.0.0.1', 26379), ('10.0.0.2', 26379)]
+        cache = Cache(sentinels, model='sentinel', service_name='mymaster',
+                      read_replicas=True).initialize()
+    '''
+    def __init__(self,
+                 sentinels: List[tuple],
+                 service_name: str = 'mymaster',
+                 read_replicas: bool = False,
+                 refresh: float = DEF_REPLICA_REFRESH,
+                 sentinel_kwargs: dict = None,
+                 **kwargs: Any) -> None:
+        '''
+        :param sentinels: `<list>` [(ip, port), ...]
+        :param service_name: `<str>` master name monitored by sentinel
+        :param read_replicas: `<bool>` read-only commands to replicas,
+            replication lag is visible to readers
+        :param refresh: `<float>` seconds replicas are discovered again
+        :param sentinel_kwargs: `<dict>` sentinel connection kwargs
+        :param kwargs: `<Any>` redis connection kwargs
+        '''
+        self.service_name = service_name
+        self.read_replicas = read_replicas
+        self.refresh = refresh
+        self.sentinel = Sentinel(sentinels,
+                                 sentinel_kwargs=sentinel_kwargs,
+                                 **kwargs)
+        self.master = self.sentinel.master_for(service_name)
+        self._kwargs = kwargs
+        # [(ip, port)], [StrictRedis]
+        self._addresses = []
+        self._replicas = []
+        self._refresh_at = 0
+        self._counter = 0
+
+    async def replica(self) -> Any:
+        '''Next replica client round-robin, master if none'''
+        now = time.monotonic()
+        if now >= self._refresh_at:
+            self._refresh_at = now + self.refresh
+            await self._discover()
+        if not self._replicas:
+            return self.master
+        self._counter = (self._counter + 1) % len(self._replicas)
+        return self._replicas[self._counter]
+
+    async def _discover(self) -> None:
+        try:
+            addresses = await self.sentinel.discover_slaves(
+                self.service_name)
+        except Exception as err:
+            logger.error(f'Discover {self.service_name} replicas error: {err}')
+            return
+        if addresses == self._addresses:
+            return
+        for client in self._replicas:
+            client.connection_pool.disconnect()
+        self._addresses = addresses
+        self._replicas = [
+            aredis.StrictRedis(host=host, port=port, **self._kwargs)
+            for host, port in addresses
+        ]
+        logger.debug(f'Discovered {self.service_name} replicas {addresses}')
+
+    def __getattr__(self, name: str) -> Any:
+        if name in READ_COMMANDS:
+            return lambda *args, **kwargs: self._read(name, args, kwargs)
+        return getattr(self.master, name)
+
+    async def _read(self, name: str, args: tuple, kwargs: dict) -> Any:
+        client = await self.replica() if self.read_replicas else self.master
+        try:
+            return await getattr(client, name)(*args, **kwargs)
+        except RedisConnectionError:
+            if client is not self.master:
+                # replica is gone, discover again on next read
+                self._refresh_at = 0
+            # master connection is rediscovered by its pool
+            return await getattr(self.master, name)(*args, **kwargs)
+
+    async def pipeline(self, transaction: bool = True,
+                       shard_hint: Any = None) -> Any:
+        if not self.read_replicas:
+            return await self.master.pipeline(transaction, shard_hint)
+        return SentinelPipeline(self, transaction)
+
+
+class SentinelPipeline:
+    '''Pipeline of only read commands runs on a replica'''
+    def __init__(self, redis: SentinelRedis, transaction: bool) -> None:
+        self.redis = redis
+        self.transaction = transaction
+        # [(name, args, kwargs)]
+        self._stack = []
+
+    def __len__(self) -> int:
+        return len(self._stack)
+
+    def __getattr__(self, name: str) -> Any:
+        async def command(*args: Any, **kwargs: Any) -> 'SentinelPipeline':
+            self._stack.append((name, args, kwargs))
+            return self
+
+        return command
+
+    async def execute(self, raise_on_error: bool = True) -> list:
+        stack, self._stack = self._stack, []
+        master = self.redis.master
+        client = master
+        if all(name in READ_COMMANDS for name, _, _ in stack):
+            client = await self.redis.replica()
+        try:
+            return await self._execute(client, stack, raise_on_error)
+        except RedisConnectionError:
+            if client is master:
+                raise
+            self.redis._refresh_at = 0
+            return await self._execute(master, stack, raise_on_error)
+
+    async def _execute(self, client: Any, stack: list,
+                       raise_on_error: bool) -> list:
+        pipe = await client.pipeline(transaction=self.transaction)
+        for name, args, kwargs in stack:
+            await getattr(pipe, name)(*args, **kwargs)
+        return await pipe.execute(raise_on_error=raise_on_error)
 
-__all__ = ['Cache', 'StrCache', 'DictCache']
 
 models = {
     'strict': aredis.StrictRedis.from_url,
-    'sentinel': Sentinel,
-    'cluster': aredis.StrictRedisCluster
+    'sentinel': SentinelRedis,
+    'cluster': aredis.StrictRedisCluster,
+    'shm': AsyncSharedMemoryCache,
+    'sharded': ShardedRedis
 }
 
-ID_TYPE = Union[int, str]
+
+class HotKeyCache:
+    '''
+    Access frequency of read keys is counted per worker by a count-min
+    sketch, keys over threshold reads in a window(top ones) are hot and
+    served from a local copy of ttl seconds, writes of this worker drop
+    it, other writes are seen in ttl seconds.
+
+    usage::
+
+        cache = Cache(url, hot_keys={'threshold': 200, 'ttl': 1})
+        cache.initialize()
+        # operators
+        cache.hot_keys()  # [('config:global', 5120), ...]
+    '''
+    def __init__(self,
+                 client: Any,
+                 threshold: int = 100,
+                 window: float = 10,
+                 ttl: float = 1,
+                 top: int = 100,
+                 width: int = 2048,
+                 depth: int = 4) -> None:
+        '''
+        :param client: `<StrictRedis>` redis client
+        :param threshold: `<int>` reads in a window a key is hot
+        :param window: `<float>` seconds counts are halved
+        :param ttl: `<float>` seconds of local copy
+        :param top: `<int>` max hot keys
+        :param width: `<int>` count-min sketch width
+        :param depth: `<int>` count-min sketch depth
+        '''
+        self.client = client
+        self.threshold = threshold
+        self.window = window
+        self.top = top
+        self.sketch = CountMinSketch(width, depth)
+        self.local = LRUCache(top * len(HOT_READS), ttl)
+        # {key: estimate}
+        self._hot = {}
+        self._decay_at = time.monotonic() + window
+
+    def __getattr__(self, name: str) -> Any:
+        if name in HOT_READS:
+            return lambda *args, **kwargs: self._read(name, args, kwargs)
+        if name in HOT_WRITES:
+            return lambda *args, **kwargs: self._write(name, args, kwargs)
+        return getattr(self.client, name)
+
+    def hot_keys(self) -> List[tuple]:
+        '''[(key, estimated reads), ...] hottest first'''
+        return sorted(self._hot.items(), key=lambda item: -item[1])
+
+    def _touch(self, key: str) -> bool:
+        now = time.monotonic()
+        if now >= self._decay_at:
+            self._decay_at = now + self.window
+            self.sketch.decay()
+            self._hot = {
+                k: v >> 1
+                for k, v in self._hot.items() if v >> 1 >= self.threshold
+            }
+        estimate = self.sketch.add(key)
+        if estimate < self.threshold:
+            return False
+        if key not in self._hot and len(self._hot) >= self.top:
+            coldest = min(self._hot, key=self._hot.get)
+            if self._hot[coldest] >= estimate:
+                return False
+            del self._hot[coldest]
+            self.local.delete(*[(name, coldest) for name in HOT_READS])
+        self._hot[key] = estimate
+        return True
+
+    async def _read(self, name: str, args: tuple, kwargs: dict) -> Any:
+        key = args[0] if args else kwargs.get('name')
+        value = self.local.get((name, key), _MISSING)
+        if value is _MISSING:
+            value = await getattr(self.client, name)(*args, **kwargs)
+            if self._touch(key):
+                self.local.set((name, key), value)
+        else:
+            self._touch(key)
+        # callers may change dict records
+        return dict(value) if isinstance(value, dict) else value
+
+    async def _write(self, name: str, args: tuple, kwargs: dict) -> Any:
+        keys = _written_keys(name, args)
+        self._drop(keys)
+        try:
+            return await getattr(self.client, name)(*args, **kwargs)
+        finally:
+            # drop again, a read may have filled it during the write
+            self._drop(keys)
+
+    def _drop(self, keys: Iterable[str]) -> None:
+        self.local.delete(*[(read, key) for key in keys for read in HOT_READS])
+
+    async def pipeline(self, *args: Any, **kwargs: Any) -> 'HotKeyPipeline':
+        return HotKeyPipeline(self, await self.client.pipeline(
+            *args, **kwargs))
+
+    async def transaction(self, func: Callable, *watches: str,
+                          **kwargs: Any) -> Any:
+        try:
+            return await self.client.transaction(func, *watches, **kwargs)
+        finally:
+            # watched keys are the ones written
+            self._drop(watches)
+
+
+def _written_keys(name: str, args: tuple) -> tuple:
+    return args if name == 'delete' else args[:1]
+
+
+class HotKeyPipeline:
+    '''Pipeline dropping local hot copies of the keys it writes'''
+    def __init__(self, hot: HotKeyCache, pipe: Any) -> None:
+        self.hot = hot
+        self.pipe = pipe
+        self._keys = []
+
+    def __len__(self) -> int:
+        return len(self.pipe)
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self.pipe, name)
+        if name not in HOT_WRITES:
+            return attr
+
+        def command(*args: Any, **kwargs: Any) -> Any:
+            self._keys.extend(_written_keys(name, args))
+            return attr(*args, **kwargs)
+
+        return command
+
+    async def execute(self, *args: Any, **kwargs: Any) -> list:
+        keys, self._keys = self._keys, []
+        self.hot._drop(keys)
+        try:
+            return await self.pipe.execute(*args, **kwargs)
+        finally:
+            self.hot._drop(keys)
 
 
 class Cache:
@@ -26,6 +624,15 @@ class Cache:
 
     url = 'redis://localhost:6379/0'
     cache = Cache(url).initialize()
+
+    # shared memory of forked workers on one host, created before fork
+    cache = Cache(model='shm', slots=65536, slot_size=512)
+
+    # commands of one event loop tick are sent in one pipeline
+    cache = Cache(url, auto_pipeline=True).initialize()
+
+    # hot keys are served from a short local copy
+    cache = Cache(url, hot_keys=True).initialize()
     '''
 
     def __init__(self,
@@ -33,16 +640,29 @@ class Cache:
                  conf_prefix: str = None,
                  model: str = 'strict',
                  decode_responses=True,
+                 auto_pipeline: bool = False,
+                 pipeline_window: float = 0,
+                 hot_keys: Union[bool, dict] = False,
                  **kwargs: Any):
         '''
         redis init
 
         :param address: `<str/list>` url or [(ip,port),...]
-            if is_sentinel is True, address = [(ip,port),...]
+            if model is sentinel, address = [(ip,port),...] of sentinels,
+            kwargs see SentinelRedis
         :param conf_prefix: `<str>` priority: address > conf_prefix
             e.g: user_redis_url -> MemRedis(conf_prefix='user')
-            if is_sentinel is True, deprecated.
-        :param model: `<str>` ['strict','sentinel','cluster'], default strict
+            if model is sentinel, deprecated.
+        :param model: `<str>` ['strict','sentinel','cluster','shm',
+            'sharded'], default strict. sharded address is url list,
+            see ShardedRedis. shm is created here(before fork), kwargs see
+            tweb.utils.shm.SharedMemoryCache
+        :param auto_pipeline: `<bool>` batch commands of one event loop
+            tick in one pipeline, see AutoPipeline
+        :param pipeline_window: `<float>` seconds commands are collected,
+            default 0 current tick
+        :param hot_keys: `<bool/dict>` detect hot keys and replicate them
+            locally, dict is kwargs of HotKeyCache
         :param kwargs: `<Any>` redis connection kwargs
         :return:
         '''
@@ -51,11 +671,18 @@ class Cache:
         self._model = model
         self._redis = models.get(model, 'strict')
         self._conf_prefix = conf_prefix
+        self._auto_pipeline = auto_pipeline
+        self._pipeline_window = pipeline_window
+        self._hot_keys = hot_keys
         kwargs.update({'decode_responses': decode_responses})
         self._kwargs = kwargs
+        if model == 'shm':
+            self.cache = self._redis(**kwargs)
 
     def initialize(self):
         # web service before start init
+        if self._model == 'shm':
+            return self
         if self._address:
             self.cache = self._redis(self._address, **self._kwargs)
             logger.debug(f'Init redis connection from {self._address}')
@@ -66,8 +693,19 @@ class Cache:
             assert url, f'{self._conf_prefix}_redis_url config does not exist'
             self.cache = self._redis(url, **self._kwargs)
             logger.debug(f'Init redis connection from {url}')
+        if self._auto_pipeline and hasattr(self.cache, 'pipeline'):
+            self.cache = AutoPipeline(self.cache, self._pipeline_window)
+        if self._hot_keys and hasattr(self.cache, 'pipeline'):
+            kwargs = self._hot_keys if isinstance(self._hot_keys,
+                                                  dict) else {}
+            self.cache = HotKeyCache(self.cache, **kwargs)
         return self
 
+    @property
+    def decode_responses(self) -> bool:
+        '''String values are read back as str, else bytes'''
+        return self._model == 'shm' or self._kwargs['decode_responses']
+
     def __getattr__(self, name):
         return getattr(self.cache, name)
 
@@ -81,7 +719,166 @@ class Cache:
         pass
 
 
-class StrCache:
+async def batch(cache: Any, commands: List[tuple]) -> list:
+    '''
+    Execute commands in one pipeline round-trip, results keep order.
+    Clients without pipeline(e.g: shm) run them concurrently.
+
+    :param cache: `<Cache>` redis cache
+    :param commands: `<list>` [(command name, args), ...]
+    :return: `<list>` results
+    '''
+    if not commands:
+        return []
+    if not hasattr(cache, 'pipeline'):
+        return await asyncio.gather(
+            *[getattr(cache, name)(*args) for name, args in commands])
+    pipe = await cache.pipeline(transaction=False)
+    for name, args in commands:
+        await getattr(pipe, name)(*args)
+    return await pipe.execute()
+
+
+class LocalCacheMixin:
+    '''
+    Optional in-process LRU in front of redis, writes publish invalidation
+    to every worker on every node.
+
+    usage::
+
+        class MyPubSub(RedisPublishSubscribe):
+            cache = center_cache
+
+        class UserCache(DictCache):
+            cache = center_cache
+            __rdskey__ = 'user:{0}'
+            local = LRUCache(maxsize=10000, ttl=5)
+            pubsub = MyPubSub
+
+        plugins.register(UserCache.listen)
+
+    Local ttl bounds staleness if an invalidation message is lost.
+    '''
+    # e.g: LRUCache(maxsize=10000, ttl=5), None disable
+    local: LRUCache = None
+    # RedisPublishSubscribe subclass, None only local invalidation
+    pubsub = None
+    __channel__: str = 'cache:invalidate'
+
+    @classmethod
+    def _channel(cls) -> str:
+        return f'{cls.__channel__}:{cls.__name__}'
+
+    @classmethod
+    def _local_get(cls, key: str) -> Any:
+        return cls.local.get(key) if cls.local is not None else None
+
+    @classmethod
+    def _local_set(cls, key: str, value: Any) -> None:
+        if cls.local is not None and value:
+            cls.local.set(key, value)
+
+    @classmethod
+    def _write(cls, result: Awaitable, *keys: str) -> Awaitable:
+        if cls.local is None:
+            return result
+        return cls._write_invalidate(result, keys)
+
+    @classmethod
+    async def _write_invalidate(cls, result: Awaitable, keys: tuple) -> Any:
+        cls.local.delete(*keys)
+        try:
+            return await result
+        finally:
+            # drop again, a read may have filled it during the write
+            cls.local.delete(*keys)
+            if cls.pubsub:
+                await cls.pubsub.publish(cls._channel(), json_dumps(keys))
+
+    @classmethod
+    async def listen(cls) -> None:
+        '''Subscribe invalidation, register in plugins'''
+        assert cls.pubsub, 'pubsub class is not configured'
+        await cls.pubsub.subscribe(cls._channel(), cls._on_invalidate)
+
+    @classmethod
+    def _on_invalidate(cls, message: str) -> None:
+        if cls.local is not None:
+            cls.local.delete(*json_loads(message))
+
+    @classmethod
+    async def _get_or_compute(cls, key: str, loader: Callable, ttl: int,
+                              beta: float, lock_ttl: Optional[int]) -> Any:
+        '''
+        XFetch: recompute before expiry with probability rising as the
+        remaining ttl falls relative to the last compute time(delta).
+        '''
+        meta = f'{key}:xfetch'
+        value, remain, delta = await batch(
+            cls.cache,
+            [cls._read_command(key), ('ttl', (key, )), ('get', (meta, ))])
+        value = cls._read_value(value)
+        if value and not _early_expired(remain, delta, beta):
+            return cls._output(value)
+        locked = False
+        if lock_ttl:
+            locked = await cls.cache.set(f'{key}:lock',
+                                         1,
+                                         ex=lock_ttl,
+                                         nx=True)
+            if not locked:
+                # another caller refreshes, keep the old value
+                if value:
+                    return cls._output(value)
+                value = await cls._wait_value(key, lock_ttl)
+                if value:
+                    return cls._output(value)
+        try:
+            start = time.monotonic()
+            result = loader()
+            if asyncio.iscoroutine(result) or \
+                    isinstance(result, asyncio.Future):
+                result = await result
+            delta = time.monotonic() - start
+            if result is None:
+                return None
+            value = cls._readback(result)
+            if not cls._cacheable(value):
+                return None
+            commands = cls._write_commands(key, result, ttl)
+            commands.append(('set', (meta, delta, ttl)))
+            await cls._write(batch(cls.cache, commands), key)
+        finally:
+            if locked:
+                await cls.cache.delete(f'{key}:lock')
+        # same as a hit reads it back
+        return cls._output(value)
+
+    @staticmethod
+    def _cacheable(value: Any) -> bool:
+        return True
+
+    @classmethod
+    async def _wait_value(cls, key: str, timeout: float) -> Any:
+        end = time.monotonic() + timeout
+        while time.monotonic() < end:
+            await asyncio.sleep(LOCK_POLL)
+            value, = await batch(cls.cache, [cls._read_command(key)])
+            value = cls._read_value(value)
+            if value:
+                return value
+        return None
+
+
+def _early_expired(remain: int, delta: Optional[str], beta: float) -> bool:
+    if remain is None or remain < 0:
+        # -1 no expire, -2 expired now
+        return remain != -1
+    delta = float(delta or 0)
+    return delta * beta * -math.log(1 - random.random()) >= remain
+
+
+class StrCache(LocalCacheMixin):
     cache = None
 
     @classmethod
@@ -93,12 +890,112 @@ class StrCache:
             px=None,
             nx=False,
             xx=False) -> Awaitable[bool]:
-        return cls.cache.set(key, value, ex=ex, px=px, nx=nx, xx=xx)
+        return cls._write(
+            cls.cache.set(key, value, ex=ex, px=px, nx=nx, xx=xx), f'{key}')
 
     @classmethod
     def get(cls, key: ID_TYPE) -> Awaitable[str]:
+        if cls.local is not None:
+            return cls._get_local(f'{key}')
         return cls.cache.get(f'{key}')
 
+    @classmethod
+    async def _get_local(cls, key: str) -> Optional[str]:
+        data = cls.local.get(key)
+        if data is None:
+            data = await cls.cache.get(key)
+            cls._local_set(key, data)
+        return data
+
+    @classmethod
+    def remove(cls, *keys: ID_TYPE) -> Awaitable[int]:
+        keys = [f'{key}' for key in keys]
+        return cls._write(cls.cache.delete(*keys), *keys)
+
+    @classmethod
+    def get_or_compute(cls,
+                       key: ID_TYPE,
+                       loader: Callable[[], Any],
+                       ttl: int,
+                       beta: float = 1.0,
+                       lock_ttl: int = None) -> Awaitable[Any]:
+        '''
+        Cached value, or loader result stored for ttl seconds. Hot key is
+        refreshed early by one caller(XFetch), others get the old value.
+
+        :param key: `<str>` key
+        :param loader: `<callable>` return value(or awaitable), None is
+            not cached
+        :param ttl: `<int>` seconds
+        :param beta: `<float>` > 1 refresh earlier, < 1 later
+        :param lock_ttl: `<int>` seconds of redis lock, only one caller
+            computes, None no lock
+        '''
+        return cls._get_or_compute(f'{key}', loader, ttl, beta, lock_ttl)
+
+    @staticmethod
+    def _read_command(key: str) -> tuple:
+        return ('get', (key, ))
+
+    @staticmethod
+    def _read_value(value: Any) -> Any:
+        return value
+
+    @staticmethod
+    def _output(value: Any) -> Any:
+        return value
+
+    @classmethod
+    def _readback(cls, value: Any) -> Any:
+        # redis stores the string form
+        if not isinstance(value, (str, bytes)):
+            value = f'{value}'
+        if isinstance(value, str) and \
+                not getattr(cls.cache, 'decode_responses', True):
+            return value.encode('utf-8')
+        return value
+
+    @staticmethod
+    def _write_commands(key: str, value: Any, ttl: int) -> list:
+        return [('set', (key, value, ttl))]
+
+    @classmethod
+    async def get_many(cls, keys: Iterable[ID_TYPE]) -> List[Optional[str]]:
+        '''MGET in one round-trip, None for misses'''
+        keys = [f'{key}' for key in keys]
+        datas = [cls._local_get(key) for key in keys]
+        misses = [key for key, data in zip(keys, datas) if data is None]
+        if not misses:
+            return datas
+        if hasattr(cls.cache, 'mget'):
+            values = await cls.cache.mget(misses)
+        else:
+            values = await batch(cls.cache, [('get', (k, )) for k in misses])
+        fetched = dict(zip(misses, values))
+        for key, value in fetched.items():
+            cls._local_set(key, value)
+        return [
+            data if data is not None else fetched.get(key)
+            for key, data in zip(keys, datas)
+        ]
+
+    @classmethod
+    async def exists_many(cls, keys: Iterable[ID_TYPE]) -> List[bool]:
+        results = await batch(cls.cache,
+                              [('exists', (f'{key}', )) for key in keys])
+        return [bool(result) for result in results]
+
+    @classmethod
+    def set_many(cls, mapping: dict, ex: int = None) -> Awaitable[list]:
+        '''
+        :param mapping: `<dict>` {key: value}
+        :param ex: `<int>` expire seconds
+        '''
+        keys = [f'{key}' for key in mapping]
+        commands = [('set', (key, value, ex))
+                    for key, value in zip(keys, mapping.values())]
+        return cls._write(batch(cls.cache, commands), *keys)
+
     @classmethod
     async def get_or_404(cls, key: ID_TYPE) -> Awaitable[Optional[str]]:
         data = await cls.get(key)
@@ -111,7 +1008,21 @@ class StrCache:
         return cls.cache.exists(f'{key}')
 
 
-class DictCache:
+class DictCache(LocalCacheMixin):
+    '''
+    Record cache of redis hash, every field is a string.
+
+    Binary mode stores a record as one msgpack value(zlib compressed over
+    __compress_size__), types are kept and decoding is much cheaper.
+    Values are bytes, the cache must not decode responses::
+
+        class UserCache(DictCache):
+            cache = Cache(url, decode_responses=False)
+            __rdskey__ = 'user:{0}'
+            __serializer__ = 'msgpack'
+            # types msgpack doesn't keep, datetime is a string
+            __cvt_keys__ = {'created': str2datetime}
+    '''
     cache = None
     # __rdskey__ eg: module:{0} ({0}->id)
     __rdskey__: str = None
@@ -121,6 +1032,48 @@ class DictCache:
     __cvt_base_keys__: dict = {'id': int}
     # user define convert fields
     __cvt_keys__: dict = {}
+    # hash: field strings of redis hash, msgpack: one binary value
+    __serializer__: str = 'hash'
+    # binary values over it are compressed
+    __compress_size__: int = 1024
+    # seconds misses(mark_missing) are cached in process, 0 disable
+    __negative_ttl__: float = 0
+    __negative_size__: int = 100000
+    # fold a generation into keys, bump_generation invalidates all records
+    __generation__: bool = False
+    # seconds the generation is cached in process
+    __generation_refresh__: float = 5
+    # seconds records live if generation is enabled, old ones expire
+    __generation_ttl__: int = 86400
+    # ((field, converter), ...) compiled from convert fields, see _compile
+    _converters: tuple = ()
+    # LRUCache of missing keys
+    _misses: LRUCache = None
+    # cached generation, monotonic time it was loaded(0 never)
+    _generation: int = 0
+    _generation_at: float = 0
+    _generation_task: asyncio.Future = None
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._compile()
+        cls._misses = LRUCache(
+            cls.__negative_size__,
+            cls.__negative_ttl__) if cls.__negative_ttl__ else None
+        cls._generation, cls._generation_at = 0, 0
+        cls._generation_task = None
+
+    @classmethod
+    def _compile(cls) -> None:
+        '''Flatten convert fields once, call it if they are changed'''
+        converters = {}
+        for keys, _type in {**cls.__cvt_base_keys__,
+                            **cls.__cvt_keys__}.items():
+            if not callable(_type):
+                continue
+            for key in keys if isinstance(keys, tuple) else (keys, ):
+                converters[key] = _type
+        cls._converters = tuple(converters.items())
 
     @staticmethod
     def _bool(val: str) -> bool:
@@ -132,21 +1085,169 @@ class DictCache:
     def _list(val: str) -> list:
         if not val or not (val.startswith('[') and val.endswith(']')):
             return None
-        return eval(val)
+        return ast.literal_eval(val)
 
     @staticmethod
     def _tuple(val: str) -> tuple:
         if not val or not (val.startswith('(') and val.endswith(')')):
             return None
-        return eval(val)
+        return ast.literal_eval(val)
+
+    @classmethod
+    def _binary(cls) -> bool:
+        return cls.__serializer__ != 'hash'
+
+    @classmethod
+    def _dumps(cls, data: dict) -> bytes:
+        assert msgpack, 'msgpack is not installed'
+        value = msgpack_dumpb(data)
+        if len(value) > cls.__compress_size__:
+            return _ZLIB + zlib.compress(value)
+        return _RAW + value
+
+    @staticmethod
+    def _loads(value: Optional[bytes]) -> dict:
+        if not value:
+            return {}
+        if value[:1] == _ZLIB:
+            return msgpack_loads(zlib.decompress(value[1:]))
+        return msgpack_loads(value[1:])
+
+    @classmethod
+    def _read_command(cls, key: str) -> tuple:
+        return ('get', (key, )) if cls._binary() else ('hgetall', (key, ))
+
+    @classmethod
+    def _read_value(cls, value: Any) -> dict:
+        return cls._loads(value) if cls._binary() else value
+
+    @classmethod
+    def _output(cls, value: dict) -> dict:
+        return AttrDict(cls._get_convert(dict(value)))
+
+    @staticmethod
+    def _cacheable(value: dict) -> bool:
+        # HMSET of no field is an error, a read of it is a miss
+        return bool(value)
+
+    @classmethod
+    def _readback(cls, value: dict) -> dict:
+        data = cls._set_filter(value)
+        if cls._binary():
+            return cls._loads(cls._dumps(data))
+        return data
+
+    @classmethod
+    def _write_commands(cls, key: str, value: dict,
+                        ttl: Optional[int]) -> list:
+        data = cls._set_filter(value)
+        if cls._binary():
+            return [('set', (key, cls._dumps(data), ttl))]
+        commands = [('delete', (key, )), ('hmset', (key, data))]
+        if ttl:
+            commands.append(('expire', (key, ttl)))
+        return commands
+
+    @classmethod
+    def get_or_compute(cls,
+                       id_: ID_TYPE,
+                       loader: Callable[[], Optional[dict]],
+                       ttl: int,
+                       beta: float = 1.0,
+                       lock_ttl: int = None) -> Awaitable[Optional[dict]]:
+        '''
+        Cached record, or loader result stored for ttl seconds, see
+        StrCache.get_or_compute. An empty record is not cached, the same
+        as None.
+        '''
+        return cls._get_or_compute_record(id_, loader, ttl, beta, lock_ttl)
+
+    @classmethod
+    async def _get_or_compute_record(cls, id_: ID_TYPE, loader: Callable,
+                                     ttl: int, beta: float,
+                                     lock_ttl: Optional[int]) -> Any:
+        await cls._ensure_generation()
+        return await cls._get_or_compute(cls._get_key(id_), loader, ttl,
+                                         beta, lock_ttl)
 
     @classmethod
     def _get_key(cls, key: int) -> str:
-        return cls.__rdskey__.format(key)
+        return cls._versioned(cls.__rdskey__.format(key))
 
     @classmethod
     def _get_dkey(cls, **kwargs: Any) -> str:
-        return cls.__rdskey__.format(**kwargs)
+        return cls._versioned(cls.__rdskey__.format(**kwargs))
+
+    @classmethod
+    def _versioned(cls, key: str) -> str:
+        if not cls.__generation__:
+            return key
+        if cls._generation_stale() and cls._generation_task is None:
+            # refresh in background, reads await _ensure_generation
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                pass
+            else:
+                cls._generation_task = asyncio.ensure_future(
+                    cls.load_generation())
+        return f'{key}@{cls._generation}'
+
+    @classmethod
+    def _generation_key(cls) -> str:
+        # classes of one key family share the generation
+        return f'generation:{cls.__rdskey__}'
+
+    @classmethod
+    def _generation_stale(cls) -> bool:
+        return not cls._generation_at or time.monotonic(
+        ) - cls._generation_at > cls.__generation_refresh__
+
+    @classmethod
+    async def load_generation(cls) -> int:
+        '''Load generation from redis, cached __generation_refresh__'''
+        try:
+            value = await cls.cache.get(cls._generation_key())
+            cls._generation = int(value or 0)
+            cls._generation_at = time.monotonic()
+        finally:
+            cls._generation_task = None
+        return cls._generation
+
+    @classmethod
+    async def _ensure_generation(cls) -> None:
+        if cls.__generation__ and cls._generation_stale():
+            await (cls._generation_task or cls.load_generation())
+
+    @classmethod
+    def _keyed(cls, command: Callable[[], Awaitable]) -> Awaitable:
+        '''Run command building keys after the generation is loaded'''
+        if cls.__generation__ and cls._generation_stale():
+            return cls._keyed_later(command)
+        return command()
+
+    @classmethod
+    async def _keyed_later(cls, command: Callable[[], Awaitable]) -> Any:
+        await cls._ensure_generation()
+        return await command()
+
+    @classmethod
+    async def bump_generation(cls) -> int:
+        '''
+        Invalidate all records of the key family in O(1), other workers
+        see it in __generation_refresh__ seconds, old records expire by
+        __generation_ttl__.
+        '''
+        assert cls.__generation__, 'generation is not enabled'
+        cls._generation = int(await cls.cache.incr(cls._generation_key()))
+        cls._generation_at = time.monotonic()
+        if cls.local is not None:
+            cls.local.clear()
+        return cls._generation
+
+    @classmethod
+    def _key_ttl(cls) -> Optional[int]:
+        return cls.__generation_ttl__ if cls.__generation__ else None
 
     @staticmethod
     def attr_dict(data):
@@ -154,7 +1255,33 @@ class DictCache:
 
     @classmethod
     def exists(cls, id_: ID_TYPE) -> Awaitable[bool]:
-        return cls.cache.exists(cls._get_key(id_))
+        return cls._keyed(lambda: cls.cache.exists(cls._get_key(id_)))
+
+    @classmethod
+    def mark_missing(cls, *ids_: ID_TYPE) -> None:
+        '''
+        Cache ids not in database for __negative_ttl__ seconds, get
+        returns None without redis, writes of the id clear it.
+        '''
+        if cls._misses is not None:
+            for id_ in ids_:
+                cls._misses.set(cls._get_key(id_), True)
+
+    @classmethod
+    def is_missing(cls, id_: ID_TYPE) -> bool:
+        return cls._misses is not None and cls._get_key(id_) in cls._misses
+
+    @classmethod
+    def _write(cls, result: Awaitable, *keys: str) -> Awaitable:
+        if cls._misses is not None:
+            cls._misses.delete(*keys)
+        return super()._write(result, *keys)
+
+    @classmethod
+    def _on_invalidate(cls, message: str) -> None:
+        super()._on_invalidate(message)
+        if cls._misses is not None:
+            cls._misses.delete(*json_loads(message))
 
     @classmethod
     async def get_or_404(cls, id_: ID_TYPE) -> Awaitable[Optional[dict]]:
@@ -167,35 +1294,173 @@ class DictCache:
     async def get(cls, id_: ID_TYPE) -> Awaitable[Optional[dict]]:
         if not id_:
             return None
-        data = await cls._get(cls._get_key(id_))
-        return AttrDict(cls._get_convert(data)) if data else None
+        await cls._ensure_generation()
+        if cls.is_missing(id_):
+            return None
+        return await cls._get_record(cls._get_key(id_))
 
     @classmethod
     async def get_cache(cls, **kwargs: Any) -> Awaitable[Optional[dict]]:
-        data = await cls._get(cls._get_dkey(**kwargs))
-        return AttrDict(cls._get_convert(data)) if data else None
+        await cls._ensure_generation()
+        return await cls._get_record(cls._get_dkey(**kwargs))
+
+    @classmethod
+    async def _get_record(cls, key: str) -> Optional[dict]:
+        data = cls._local_get(key)
+        if data is None:
+            data = await cls._get(key)
+            if not data:
+                return None
+            data = cls._get_convert(data)
+            cls._local_set(key, data)
+        # copy, callers must not change the local cached record
+        return AttrDict(data)
+
+    @classmethod
+    async def get_many(cls,
+                       ids_: Iterable[ID_TYPE]) -> List[Optional[dict]]:
+        '''
+        Pipelined HGETALL in one round-trip, results keep input order,
+        None for misses.
+        '''
+        await cls._ensure_generation()
+        keys = [
+            cls._get_key(id_) if id_ and not cls.is_missing(id_) else None
+            for id_ in ids_
+        ]
+        datas = [cls._local_get(key) if key else None for key in keys]
+        misses = list({
+            key: None
+            for key, data in zip(keys, datas) if key and data is None
+        })
+        fetched = {}
+        if misses:
+            values = await batch(cls.cache,
+                                 [cls._read_command(key) for key in misses])
+            for key, value in zip(misses, values):
+                value = cls._read_value(value)
+                if value:
+                    fetched[key] = cls._get_convert(value)
+                    cls._local_set(key, fetched[key])
+        results = []
+        for key, data in zip(keys, datas):
+            data = data if data is not None else fetched.get(key)
+            results.append(AttrDict(data) if data else None)
+        return results
+
+    @classmethod
+    async def exists_many(cls, ids_: Iterable[ID_TYPE]) -> List[bool]:
+        await cls._ensure_generation()
+        results = await batch(cls.cache, [('exists', (cls._get_key(id_), ))
+                                          for id_ in ids_])
+        return [bool(result) for result in results]
+
+    @classmethod
+    def set_many(cls, mapping: dict) -> Awaitable[list]:
+        '''
+        :param mapping: `<dict>` {id: {field: value}}
+        '''
+        datas = [cls._set_filter(data) for data in mapping.values()]
+
+        def command() -> Awaitable[list]:
+            keys = [cls._get_key(id_) for id_ in mapping]
+            if cls._binary():
+                # every record is merged atomically, concurrently
+                return cls._write(
+                    asyncio.gather(*[
+                        cls._set_binary(key, data)
+                        for key, data in zip(keys, datas)
+                    ]), *keys)
+            commands = [('hmset', (key, data))
+                        for key, data in zip(keys, datas)]
+            if cls._key_ttl():
+                commands += [('expire', (key, cls._key_ttl()))
+                             for key in keys]
+            return cls._write(batch(cls.cache, commands), *keys)
+
+        return cls._keyed(command)
 
     @classmethod
     def _get(cls, key: str) -> Awaitable[Optional[dict]]:
+        if cls._binary():
+            return cls._get_binary(key)
         return cls.cache.hgetall(key)
 
+    @classmethod
+    async def _get_binary(cls, key: str) -> dict:
+        return cls._loads(await cls.cache.get(key))
+
     @classmethod
     def _set(cls, key_: str, **kwargs: Any) -> Awaitable[bool]:
+        if cls._binary():
+            return cls._set_binary(key_, kwargs)
+        if cls._key_ttl():
+            return cls._set_expire(key_, kwargs)
         return cls.cache.hmset(key_, kwargs)
 
     @classmethod
-    def _get_convert(cls, data: dict) -> dict:
-        _keys = {**cls.__cvt_base_keys__, **cls.__cvt_keys__}
-        for _key, _type in _keys.items():
-            if not callable(_type):
-                continue
-            if isinstance(_key, tuple):
-                for key in _key:
-                    if data.get(key):
-                        data.update({key: _type(data[key])})
+    async def _set_expire(cls, key: str, data: dict) -> bool:
+        result, _ = await batch(
+            cls.cache, [('hmset', (key, data)),
+                        ('expire', (key, cls._key_ttl()))])
+        return result
+
+    @classmethod
+    async def _set_binary(cls, key: str, data: dict) -> bool:
+        # fields are merged into the stored record like HMSET
+        def merge(record: dict) -> bool:
+            record.update(data)
+            return True
+
+        return await cls._update_binary(key, merge)
+
+    @classmethod
+    async def _hdel_binary(cls, key: str, *fields: str) -> int:
+        def pop(record: dict) -> int:
+            return sum(1 for field in fields
+                       if record.pop(field, _MISSING) is not _MISSING)
+
+        return await cls._update_binary(key, pop)
+
+    @classmethod
+    async def _update_binary(cls, key: str,
+                             change: Callable[[dict], Any]) -> Any:
+        '''
+        Atomic read-modify-write of a binary record, WATCH/MULTI retried
+        on conflict(redis) or under the bucket lock(shm).
+
+        :param change: `<callable>` change(record) changes the record in
+            place, empty record deletes the key
+        :return: result of change
+        '''
+        def apply(value: Optional[bytes]) -> tuple:
+            record = cls._loads(value)
+            result = change(record)
+            return result, cls._dumps(record) if record else None
+
+        if not hasattr(cls.cache, 'pipeline'):
+            return await cls.cache.update(key, apply, ex=cls._key_ttl())
+
+        async def execute(pipe: Any) -> Any:
+            result, value = apply(await pipe.get(key))
+            pipe.multi()
+            if value is None:
+                await pipe.delete(key)
             else:
-                if data.get(_key):
-                    data.update({_key: _type(data[_key])})
+                await pipe.set(key, value, ex=cls._key_ttl())
+            return result
+
+        return await cls.cache.transaction(execute,
+                                           key,
+                                           value_from_callable=True)
+
+    @classmethod
+    def _get_convert(cls, data: dict) -> dict:
+        for key, _type in cls._converters:
+            value = data.get(key)
+            # binary mode values keep their types, convert strings only
+            if value and isinstance(value, str):
+                data[key] = _type(value)
         return data
 
     @classmethod
@@ -205,7 +1470,8 @@ class DictCache:
                 k: v
                 for k, v in kwargs.items() if k not in cls.__filters__
             }
-        if replace_none:
+        # binary mode values keep their types
+        if replace_none and not cls._binary():
             kwargs = {
                 k: str(v) if v is not None else ''
                 for k, v in kwargs.items()
@@ -215,26 +1481,66 @@ class DictCache:
     @classmethod
     def set(cls, id_: ID_TYPE, **kwargs: Any) -> Awaitable[bool]:
         kwargs = cls._set_filter(kwargs)
-        return cls._set(cls._get_key(id_), **kwargs)
+
+        def command() -> Awaitable[bool]:
+            key = cls._get_key(id_)
+            return cls._write(cls._set(key, **kwargs), key)
+
+        return cls._keyed(command)
 
     @classmethod
     def set_cache(cls, **kwargs: Any) -> Awaitable[bool]:
         kwargs = cls._set_filter(kwargs)
-        return cls._set(cls._get_dkey(**kwargs), **kwargs)
+
+        def command() -> Awaitable[bool]:
+            key = cls._get_dkey(**kwargs)
+            return cls._write(cls._set(key, **kwargs), key)
+
+        return cls._keyed(command)
+
+    @classmethod
+    def replace(cls, id_: ID_TYPE, **kwargs: Any) -> Awaitable[list]:
+        '''
+        Write the whole record, fields not given are dropped, binary mode
+        writes it without reading the stored one.
+        '''
+        def command() -> Awaitable[list]:
+            key = cls._get_key(id_)
+            return cls._write(
+                batch(cls.cache,
+                      cls._write_commands(key, kwargs, cls._key_ttl())), key)
+
+        return cls._keyed(command)
 
     @classmethod
     def remove(cls, id_: ID_TYPE) -> Awaitable[int]:
-        return cls.cache.delete(cls._get_key(id_))
+        return cls.removes(id_)
 
     @classmethod
     def removes(cls, *ids_: ID_TYPE) -> Awaitable[int]:
-        keys = [cls._get_key(_id) for _id in ids_]
-        return cls.cache.delete(*keys)
+        def command() -> Awaitable[int]:
+            keys = [cls._get_key(_id) for _id in ids_]
+            return cls._write(cls.cache.delete(*keys), *keys)
+
+        return cls._keyed(command)
 
     @classmethod
     def remove_cache(cls, **kwargs: Any) -> Awaitable[int]:
-        return cls.cache.delete(cls._get_dkey(**kwargs))
+        def command() -> Awaitable[int]:
+            key = cls._get_dkey(**kwargs)
+            return cls._write(cls.cache.delete(key), key)
+
+        return cls._keyed(command)
 
     @classmethod
     def remove_key(cls, id_: ID_TYPE, *keys: ID_TYPE) -> Awaitable[int]:
-        return cls.cache.hdel(cls._get_key(id_), *keys)
+        def command() -> Awaitable[int]:
+            key = cls._get_key(id_)
+            if cls._binary():
+                return cls._write(cls._hdel_binary(key, *keys), key)
+            return cls._write(cls.cache.hdel(key, *keys), key)
+
+        return cls._keyed(command)
+
+
+DictCache._compile()
@@ -0,0 +1,192 @@
+'''
+Write-behind buffered counters.
+
+Increments are kept in memory per worker and flushed in batches, on a
+timer or when pending keys are over max_pending, one round-trip instead
+of one per hit.
+
+usage::
+
+    # redis hash fields, pipelined HINCRBY
+    article_stat = RedisCounter(center_cache, interval=5)
+    article_stat.incr('article:stat:1', 'views')
+
+    # database columns, one UPDATE ... CASE per field
+    article_views = article_service.counter()
+    article_views.incr(1, 'views')
+
+    plugins.register(article_stat.start)
+    # flushed on the serving loop after it stopped
+    http.atexit_register(article_stat.close)
+'''
+import asyncio
+from typing import Any, Dict, Hashable, Optional, Tuple
+import peewee
+
+from tweb.utils.log import logger
+
+__all__ = ['BufferedCounter', 'RedisCounter', 'ModelCounter']
+
+# default flush seconds and pending keys
+DEF_INTERVAL = 5
+DEF_MAX_PENDING = 10000
+
+
+class BufferedCounter:
+    def __init__(self,
+                 interval: float = DEF_INTERVAL,
+                 max_pending: int = DEF_MAX_PENDING) -> None:
+        '''
+        :param interval: `<float>` flush seconds
+        :param max_pending: `<int>` flush when pending (key, field) are
+            over it
+        '''
+        self.interval = interval
+        self.max_pending = max_pending
+        # {(key, field): amount}
+        self._pending: Dict[Tuple[Hashable, str], int] = {}
+        # serving loop, set by start
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def incr(self, key: Hashable, field: str, amount: int = 1) -> None:
+        item = (key, field)
+        self._pending[item] = self._pending.get(item, 0) + amount
+        if len(self._pending) >= self.max_pending:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            asyncio.ensure_future(self.flush())
+
+    def pending(self, key: Hashable, field: str) -> int:
+        '''Amount not flushed, add it to the stored value'''
+        return self._pending.get((key, field), 0)
+
+    async def flush(self) -> int:
+        '''
+        Write pending increments, merged back if it fails.
+
+        :return: `<int>` flushed (key, field) count
+        '''
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            await self._flush(pending)
+        except Exception as err:
+            logger.error(f'Flush {self.__class__.__name__} error: {err}')
+            for item, amount in pending.items():
+                self._pending[item] = self._pending.get(item, 0) + amount
+            return 0
+        return len(pending)
+
+    async def _flush(self, pending: Dict[Tuple[Hashable, str], int]) -> None:
+        raise NotImplementedError
+
+    async def start(self) -> None:
+        '''Flush every interval seconds, plugin task'''
+        self._loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def close(self) -> None:
+        '''
+        Flush on shutdown, e.g: atexit_register, runs on the serving loop,
+        connections of it can not be used by other loops.
+        '''
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            # not started, e.g: master of fork_processes
+            self._check_closed()
+            return
+        if loop.is_running():
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                raise RuntimeError('close blocks the serving loop, '
+                                   'await flush instead')
+            # called in other thread
+            asyncio.run_coroutine_threadsafe(self.flush(), loop).result()
+        else:
+            loop.run_until_complete(self.flush())
+        self._check_closed()
+
+    def _check_closed(self) -> None:
+        if self._pending:
+            logger.error(f'{self.__class__.__name__} closed with '
+                         f'{len(self._pending)} pending increments lost')
+
+
+class RedisCounter(BufferedCounter):
+    def __init__(self,
+                 cache: Any,
+                 interval: float = DEF_INTERVAL,
+                 max_pending: int = DEF_MAX_PENDING) -> None:
+        '''
+        :param cache: `<Cache>` redis cache, key is hash and field
+        '''
+        super().__init__(interval, max_pending)
+        self.cache = cache
+
+    async def _flush(self, pending: Dict[Tuple[Hashable, str], int]) -> None:
+        # aredis is optional for ModelCounter
+        from tweb.cache import batch
+        await batch(self.cache,
+                    [('hincrby', (f'{key}', field, amount))
+                     for (key, field), amount in pending.items() if amount])
+
+
+class ModelCounter(BufferedCounter):
+    def __init__(self,
+                 model: peewee.Model,
+                 interval: float = DEF_INTERVAL,
+                 max_pending: int = DEF_MAX_PENDING,
+                 service: Optional[Any] = None) -> None:
+        '''
+        :param model: `<peewee.model>` key is primary key, field is column
+        :param service: `<BaseService>` invalidate cached rows on flush
+        '''
+        super().__init__(interval, max_pending)
+        self.model = model
+        self.service = service
+
+    def _update(self, pending: Dict[Tuple[Hashable, str], int]) -> list:
+        # {field: [(pk, amount)]}
+        fields = {}
+        for (pk, field), amount in pending.items():
+            if amount:
+                fields.setdefault(field, []).append((pk, amount))
+        pk_field = self.model._meta.primary_key
+        pks = set()
+        with self.model._meta.database.atomic():
+            for field, amounts in fields.items():
+                column = getattr(self.model, field)
+                ids = [pk for pk, _ in amounts]
+                self.model.update({
+                    column: column + peewee.Case(pk_field, amounts, 0)
+                }).where(pk_field << ids).execute()
+                pks.update(ids)
+        return list(pks)
+
+    async def _flush(self, pending: Dict[Tuple[Hashable, str], int]) -> None:
+        loop = asyncio.get_event_loop()
+        pks = await loop.run_in_executor(None, self._update, pending)
+        if self.service is not None and pks:
+            self.service.invalidate(*pks)
+
+    def close(self) -> None:
+        '''Flush on shutdown, the database is written directly'''
+        pending, self._pending = self._pending, {}
+        if pending:
+            try:
+                pks = self._update(pending)
+            except Exception as err:
+                logger.error(f'Flush {self.__class__.__name__} error: {err}')
+                self._pending = pending
+            else:
+                if self.service is not None and pks:
+                    self.service.invalidate(*pks)
+        self._check_closed()
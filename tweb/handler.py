@@ -1,23 +1,38 @@
 import io
+import os
+import asyncio
+import hashlib
 import datetime
+import email.utils
 import logging
-from typing import Union, Tuple, Optional, Any
+from typing import Union, Tuple, Optional, Any, AsyncIterator, BinaryIO
 import tornado.web
+import tornado.iostream
+from tornado import httputil
 from xform.form import Form
 
 from tweb.utils import strings
 from tweb.response import content, DATA_TYPE
 from tweb.utils.ecodes import ECodes
-from tweb.utils.escape import json_dumps
+from tweb.utils import compress
+from tweb.utils import escape
+from tweb.utils.escape import json_dumpb
 from tweb.utils.settings import CORS_HEADERS
 # from tweb.utils.log import logger
 from .exceptions import trace_info, Error
 
+# send_file read size and flush threshold (bytes)
+DEF_CHUNK_SIZE = 64 * 1024
+DEF_FLUSH_SIZE = 1024 * 1024
+FILE_SOURCE = Union[str, BinaryIO, AsyncIterator[bytes]]
+
 
 class BaseHandler(tornado.web.RequestHandler):
     err_resp_only_json: bool = False
     # router define, list object
     url_pattern: str = None
+    # compress json response, False to opt-out for the route
+    compress_json: bool = True
 
     def initialize(self):
         pass
@@ -112,32 +127,100 @@ class BaseHandler(tornado.web.RequestHandler):
     def success(self,
                 msg: str = None,
                 data: DATA_TYPE = None,
-                **kwargs: Any) -> None:
+                **kwargs: Any) -> Optional[asyncio.Future]:
         '''
         Write success message to browser.
         '''
         ecode = ECodes.success
-        self.process(ecode[0], msg or ecode[1], data, **kwargs)
+        return self.process(ecode[0], msg or ecode[1], data, **kwargs)
 
     def failure(self,
                 code: int = ECodes.fail[0],
                 msg: str = None,
                 data: DATA_TYPE = None,
-                **kwargs) -> None:
+                **kwargs) -> Optional[asyncio.Future]:
         '''
         Write failure message to browser.
         '''
-        self.process(code, msg, data, **kwargs)
+        return self.process(code, msg, data, **kwargs)
+
+    def jsonify(self, **kwargs: Any) -> Optional[asyncio.Future]:
+        return self.finish_json(json_dumpb(kwargs))
+
+    def finish_json(self,
+                    body: Union[str, bytes],
+                    offload: bool = True) -> Optional[asyncio.Future]:
+        '''
+        Finish json body, compressed with gzip or brotli(if installed)
+        negotiated by Accept-Encoding.
 
-    def jsonify(self, **kwargs: Any) -> None:
-        self.finish(json_dumps(kwargs))
+        Settings: compress_json, compress_min_size, compress_level(gzip),
+        brotli_quality, compress_thread_size(compress in thread pool if
+        body size is over it, return future of finish).
+
+        :param body: `<str/bytes>` json body
+        :param offload: `<bool>` allow compress in thread pool
+        '''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        encoding = self._json_encoding(body)
+        if not encoding:
+            self.finish(body)
+            return None
+        self.set_header('Content-Encoding', encoding)
+        self.add_header('Vary', 'Accept-Encoding')
+        level = self.settings.get('brotli_quality') if encoding == 'br' \
+            else self.settings.get('compress_level')
+        if not offload or \
+                len(body) < self.settings.get('compress_thread_size', 262144):
+            self.finish(compress.compress(body, encoding, level))
+            return None
+        # finished by the future, not by tornado auto finish
+        self._auto_finish = False
+        future = asyncio.ensure_future(
+            self._finish_compressed(body, encoding, level))
+        # callers may not await it, errors must still finish the request
+        future.add_done_callback(self._on_compressed)
+        return future
+
+    def _on_compressed(self, future: asyncio.Future) -> None:
+        if future.cancelled():
+            return
+        err = future.exception()
+        if err is None:
+            return
+        logging.error(f'Compress json response error: {err!r}')
+        if not self._finished:
+            self.send_error(500, log_record=False)
+
+    async def _finish_compressed(self, body: bytes, encoding: str,
+                                 level: int) -> None:
+        loop = asyncio.get_event_loop()
+        data = await loop.run_in_executor(None, compress.compress, body,
+                                          encoding, level)
+        if not self._finished:
+            await self.finish(data)
+
+    def _json_encoding(self, body: bytes) -> Optional[str]:
+        if not self.compress_json or \
+                not self.settings.get('compress_json', True):
+            return None
+        if len(body) < self.settings.get('compress_min_size', 1024) or \
+                self.request.method == 'HEAD' or \
+                'Content-Encoding' in self._headers:
+            return None
+        return compress.negotiate(
+            self.request.headers.get('Accept-Encoding'))
 
     def string(self, text: str) -> None:
         self.finish(text)
 
-    def files(self, filename: str, stream: io.BytesIO) -> None:
+    def files(self,
+              filename: str,
+              stream: io.BytesIO,
+              modified: float = None) -> None:
         '''
-        Download file.
+        Download file, support Range and conditional(ETag) request.
 
         usage::
 
@@ -148,27 +231,194 @@ class BaseHandler(tornado.web.RequestHandler):
 
         :param filename: `<str>` file name
         :param stream: `<BytesIO>` stream object
+        :param modified: `<float>` last modified timestamp
         '''
         self.set_stream_header(filename)
-        stream.seek(0, 0)
-        while 1:
-            data = stream.read(4096)
-            if not data:
-                break
-            self.write(data)
+        data = stream.getvalue()
         stream.close()
-        self.finish()
+        self._finish_bytes(data, modified)
+
+    async def send_file(self,
+                        source: FILE_SOURCE,
+                        filename: str = None,
+                        content_type: str = None,
+                        chunk_size: int = DEF_CHUNK_SIZE,
+                        flush_size: int = DEF_FLUSH_SIZE) -> None:
+        '''
+        Stream file to client, flush every `flush_size` bytes and wait
+        the client to receive it, memory keeps constant for large file.
+        Range and conditional request are supported if source is a path.
 
-    def stream(self, stream: io.BytesIO, content_type: str) -> None:
+        usage::
+
+            await self.send_file('/data/export/users.csv')
+            #or
+            await self.send_file(open(path, 'rb'), 'users.csv')
+            #or
+            async def rows():
+                async for row in query():
+                    yield row.encode('utf8')
+            await self.send_file(rows(), 'users.csv')
+
+        :param source: `<str/file/async iterator>` file path, binary
+            file object or async iterator of bytes
+        :param filename: `<str>` download name, default path base name,
+            if none and not a path, output inline with content_type
+        :param content_type: `<str>` default application/octet-stream
+        :param chunk_size: `<int>` read size of file
+        :param flush_size: `<int>` flush threshold
         '''
-        Output file, e.g: qrcode
+        length = None
+        if isinstance(source, str):
+            filename = filename or os.path.basename(source)
+            stat = os.stat(source)
+        if filename:
+            self.set_stream_header(filename)
+        if content_type or not filename:
+            self.set_header('Content-Type', content_type
+                            or 'application/octet-stream')
+        if isinstance(source, str):
+            etag = '"%x-%x"' % (int(stat.st_mtime), stat.st_size)
+            start_end = self._check_range(stat.st_size, etag, stat.st_mtime)
+            if not start_end:
+                return
+            start, length = start_end[0], start_end[1] - start_end[0]
+            self.set_header('Content-Length', length)
+            source = open(source, 'rb')
+            if start:
+                source.seek(start)
+        pending = 0
+        try:
+            async for chunk in self._iter_chunks(source, chunk_size, length):
+                self.write(chunk)
+                pending += len(chunk)
+                if pending >= flush_size:
+                    pending = 0
+                    await self.flush()
+        except tornado.iostream.StreamClosedError:
+            return
+        finally:
+            if hasattr(source, 'close') and not hasattr(source, '__aiter__'):
+                source.close()
+        await self.finish()
+
+    @staticmethod
+    async def _iter_chunks(source: FILE_SOURCE,
+                           chunk_size: int,
+                           length: int = None) -> AsyncIterator[bytes]:
+        if hasattr(source, '__aiter__'):
+            async for chunk in source:
+                if chunk:
+                    yield chunk
+            return
+        while length is None or length > 0:
+            size = chunk_size if length is None else min(chunk_size, length)
+            chunk = source.read(size)
+            if not chunk:
+                break
+            if length is not None:
+                length -= len(chunk)
+            yield chunk
+
+    def stream(self,
+               stream: io.BytesIO,
+               content_type: str,
+               modified: float = None) -> None:
+        '''
+        Output file, e.g: qrcode, support Range and conditional request.
 
         :param stream: `<BytesIO>` stream object
         :param content_type: `<str>` e.g: image/jpg
+        :param modified: `<float>` last modified timestamp
         :return:
         '''
         self.set_header('Content-Type', content_type)
-        self.finish(stream.getvalue())
+        self._finish_bytes(stream.getvalue(), modified)
+
+    def _finish_bytes(self, data: bytes, modified: float = None) -> None:
+        etag = '"%s"' % hashlib.sha1(data).hexdigest()
+        start_end = self._check_range(len(data), etag, modified)
+        if not start_end:
+            return
+        start, end = start_end
+        if start or end != len(data):
+            data = data[start:end]
+        self.finish(data)
+
+    def _check_range(self,
+                     size: int,
+                     etag: str,
+                     modified: float = None) -> Optional[Tuple[int, int]]:
+        '''
+        Set validators, process conditional(If-None-Match,
+        If-Modified-Since) and Range(If-Range) request headers.
+
+        :return: `<tuple>` (start, end) bytes to send, None if the
+            response is finished(304/416)
+        '''
+        self.set_header('Etag', etag)
+        self.set_header('Accept-Ranges', 'bytes')
+        if modified is not None:
+            self.set_header(
+                'Last-Modified',
+                datetime.datetime.fromtimestamp(int(modified),
+                                                datetime.timezone.utc))
+        if self._not_modified(etag, modified):
+            self.set_status(304)
+            self.finish()
+            return None
+        range_header = self.request.headers.get('Range')
+        if self.request.method != 'GET' or not range_header or \
+                not self._if_range(etag, modified):
+            return 0, size
+        request_range = httputil._parse_request_range(range_header)
+        if not request_range:
+            return 0, size
+        start, end = request_range
+        if start is not None and start < 0:
+            start = max(start + size, 0)
+        if (start is not None and
+            (start >= size or (end is not None and start >= end))) or \
+                end == 0:
+            self.set_status(416)
+            self.set_header('Content-Type', 'text/plain')
+            self.set_header('Content-Range', f'bytes */{size}')
+            self.finish()
+            return None
+        start = start or 0
+        end = min(end, size) if end is not None else size
+        if end - start != size:
+            self.set_status(206)
+            self.set_header('Content-Range',
+                            httputil._get_content_range(start, end, size))
+        return start, end
+
+    def _not_modified(self, etag: str, modified: float = None) -> bool:
+        if self.request.method not in ('GET', 'HEAD'):
+            return False
+        if self.request.headers.get('If-None-Match'):
+            return self.check_etag_header()
+        since = self._parse_http_date(
+            self.request.headers.get('If-Modified-Since'))
+        return bool(modified and since and int(modified) <= since)
+
+    def _if_range(self, etag: str, modified: float = None) -> bool:
+        value = self.request.headers.get('If-Range')
+        if not value:
+            return True
+        if value.startswith('"') or value.startswith('W/'):
+            return value == etag
+        since = self._parse_http_date(value)
+        return bool(modified and since and int(modified) == since)
+
+    @staticmethod
+    def _parse_http_date(value: str) -> Optional[float]:
+        if not value:
+            return None
+        try:
+            return email.utils.parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError):
+            return None
 
     def page_not_found(self, url: str = None) -> None:
         self.process(404, url=url)
@@ -217,14 +467,16 @@ class BaseHandler(tornado.web.RequestHandler):
                           msg=kwargs.get('msg')
                           or self.lang('Server to open a small guess'))
 
-        if strings.req_is_json(self.request) or self.err_resp_only_json:
+        if self.accept_msgpack:
+            self.finish_json(self.dump_content(ret), offload=False)
+        elif strings.req_is_json(self.request) or self.err_resp_only_json:
             self.set_json_header()
-            self.finish(json_dumps(ret))
+            self.finish_json(json_dumpb(ret), offload=False)
         else:
             url = kwargs.get('url')
             if not url:
                 self.set_header('Content-Type', 'text/plain;charset=UTF-8')
-                self.finish(json_dumps(ret))
+                self.finish_json(json_dumpb(ret), offload=False)
             else:
                 self.render_html(url, data=ret)
 
@@ -233,7 +485,7 @@ class BaseHandler(tornado.web.RequestHandler):
                 msg: str = None,
                 data: DATA_TYPE = None,
                 url: str = None,
-                **kwargs: Any) -> None:
+                **kwargs: Any) -> Optional[asyncio.Future]:
         '''
         Process server write json data to client.
         cannot used @callback
@@ -244,8 +496,30 @@ class BaseHandler(tornado.web.RequestHandler):
         if url:
             self.render_html(url, data=ret)
         else:
+            return self.finish_json(self.dump_content(ret))
+
+    @property
+    def accept_msgpack(self) -> bool:
+        '''Client accepts MessagePack(msgpack installed)'''
+        if escape.msgpack is None:
+            return False
+        accept = self.request.headers.get('Accept', '')
+        return any(_type in accept for _type in escape.MSGPACK_TYPES)
+
+    def dump_content(self, ret: dict) -> bytes:
+        '''
+        Serialize content() envelope and set Content-Type,
+        MessagePack if Accept: application/msgpack, else json.
+        '''
+        if escape.msgpack is None:
             self.set_json_header()
-            self.finish(json_dumps(ret))
+            return json_dumpb(ret)
+        self.add_header('Vary', 'Accept')
+        if self.accept_msgpack:
+            self.set_header('Content-Type', escape.MSGPACK_TYPES[0])
+            return escape.msgpack_dumpb(ret)
+        self.set_json_header()
+        return json_dumpb(ret)
 
     def render_html(self, template_name: str, **kwargs: Any) -> None:
         '''
@@ -0,0 +1,398 @@
+'''
+Response cache, request coalescing(single flight) and version based
+ETag of GET handlers.
+
+First tier is an in-process LRU with TTL, the optional second tier is
+shared by workers and nodes through redis(tweb.cache.Cache).
+
+usage::
+
+    center_cache = Cache(conf_prefix='center')
+
+    @router('/users')
+    class UserListHandler(BaseHandler):
+        @cache_response(60, args=('page', 'limit'), stale=30,
+                        cache=center_cache)
+        async def get(self):
+            data = service.find_by_page(...)
+            return self.success(data=data)
+
+    # invalidate
+    UserListHandler.get.cache.clear()
+
+    # concurrent identical requests share one computation
+    @router('/top')
+    class TopHandler(BaseHandler):
+        @single_flight(args=('limit', ))
+        async def get(self):
+            ...
+
+    # 304 before the handler runs if the version is unchanged
+    @router('/articles')
+    class ArticleListHandler(BaseHandler):
+        @etag_version(lambda handler: article_service.version())
+        # or redis counter, incr it when articles change
+        # @etag_version(lambda handler: center_cache.get('article:ver'))
+        async def get(self):
+            ...
+'''
+import time
+import base64
+import hashlib
+import asyncio
+import functools
+from typing import Any, Callable, Optional, Tuple
+import tornado.web
+
+from tweb.utils.lru import LRUCache
+from tweb.utils.escape import json_dumps, json_loads
+from tweb.utils.log import logger
+
+__all__ = [
+    'ResponseCache', 'cache_response', 'SingleFlight', 'single_flight',
+    'etag_version'
+]
+
+# cached response headers
+CACHE_HEADERS = ('Content-Type', 'Content-Encoding', 'Vary', 'Etag',
+                 'Last-Modified')
+DEF_VARY = ('Accept', 'Accept-Encoding')
+# max seconds followers wait for the leader request
+DEF_WAIT_TIMEOUT = 30
+
+
+class CachedResponse:
+    __slots__ = ('status', 'headers', 'body', 'created', 'refreshing')
+
+    def __init__(self, status: int, headers: dict, body: bytes,
+                 created: float = None) -> None:
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.created = created or time.time()
+        self.refreshing = False
+
+    def dumps(self) -> str:
+        return json_dumps({
+            's': self.status,
+            'h': self.headers,
+            'b': base64.b64encode(self.body).decode('ascii'),
+            't': self.created
+        })
+
+    @classmethod
+    def loads(cls, value: str) -> 'CachedResponse':
+        data = json_loads(value)
+        return cls(data['s'], data['h'], base64.b64decode(data['b']),
+                   data['t'])
+
+
+class ResponseCache:
+    def __init__(self,
+                 ttl: float,
+                 args: Optional[Tuple[str, ...]] = None,
+                 vary: Tuple[str, ...] = DEF_VARY,
+                 stale: float = 0,
+                 cache: Any = None,
+                 maxsize: int = 1024,
+                 prefix: str = 'resp:cache') -> None:
+        '''
+        :param ttl: `<float>` fresh seconds
+        :param args: `<tuple>` query arguments in key, None all arguments
+        :param vary: `<tuple>` request headers in key
+        :param stale: `<float>` seconds stale response is served while
+            one request refreshes it
+        :param cache: `<Cache>` redis second tier, default None
+        :param maxsize: `<int>` in-process LRU max items
+        :param prefix: `<str>` redis key prefix
+        '''
+        self.ttl = ttl
+        self.args = args
+        self.vary = vary
+        self.stale = stale
+        self.cache = cache
+        self.prefix = prefix
+        self.local = LRUCache(maxsize, ttl + stale)
+
+    def make_key(self, handler: tornado.web.RequestHandler) -> str:
+        return make_key(handler, self.args, self.vary)
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self.local.get(key)
+        if entry or not self.cache:
+            return entry
+        try:
+            value = await self.cache.get(f'{self.prefix}:{key}')
+        except Exception as err:
+            logger.error(f'Get response cache error: {err}')
+            return None
+        if not value:
+            return None
+        entry = CachedResponse.loads(value)
+        remain = entry.created + self.ttl + self.stale - time.time()
+        if remain <= 0:
+            return None
+        self.local.set(key, entry, remain)
+        return entry
+
+    def set(self, key: str, entry: CachedResponse) -> None:
+        self.local.set(key, entry)
+        if self.cache:
+            asyncio.ensure_future(self._set_shared(key, entry))
+
+    async def _set_shared(self, key: str, entry: CachedResponse) -> None:
+        try:
+            await self.cache.set(f'{self.prefix}:{key}',
+                                 entry.dumps(),
+                                 ex=max(int(self.ttl + self.stale), 1))
+        except Exception as err:
+            logger.error(f'Set response cache error: {err}')
+
+    def is_fresh(self, entry: CachedResponse) -> bool:
+        return time.time() - entry.created < self.ttl
+
+    def clear(self) -> None:
+        '''Clear in-process tier, redis tier expires by ttl'''
+        self.local.clear()
+
+    def capture(self, handler: tornado.web.RequestHandler,
+                key: str) -> Callable[[], None]:
+        '''
+        Store 200 response of GET request, call the returned function
+        after the handler method returned without error. Responses of
+        send_error are not stored, Error is rendered with status 200.
+        '''
+        state = {'returned': False, 'failed': False, 'entry': None}
+        send_error = handler.send_error
+
+        def _send_error(*args: Any, **kwargs: Any) -> None:
+            state['failed'] = True
+            return send_error(*args, **kwargs)
+
+        def _store(entry: CachedResponse) -> None:
+            if entry.status != 200 or handler.request.method != 'GET' or \
+                    state['failed']:
+                return
+            if state['returned']:
+                # auto finished after the method returned
+                self.set(key, entry)
+            else:
+                state['entry'] = entry
+
+        def _returned() -> None:
+            state['returned'] = True
+            if state['entry'] is not None and not state['failed']:
+                self.set(key, state['entry'])
+
+        handler.send_error = _send_error
+        capture_response(handler, _store)
+        return _returned
+
+
+def capture_response(handler: tornado.web.RequestHandler,
+                     callback: Callable[[CachedResponse], None]) -> None:
+    '''Wrap handler finish, callback with the finished response'''
+    finish = handler.finish
+
+    def _finish(chunk: Any = None) -> Any:
+        if chunk is not None:
+            handler.write(chunk)
+        headers = {
+            name: handler._headers[name]
+            for name in CACHE_HEADERS if name in handler._headers
+        }
+        body = b''.join(handler._write_buffer)
+        callback(CachedResponse(handler.get_status(), headers, body))
+        return finish()
+
+    handler.finish = _finish
+
+
+def output_response(handler: tornado.web.RequestHandler,
+                    entry: CachedResponse) -> None:
+    handler.set_status(entry.status)
+    for name, value in entry.headers.items():
+        handler.set_header(name, value)
+    handler.finish(entry.body)
+
+
+def make_key(handler: tornado.web.RequestHandler,
+             args: Optional[Tuple[str, ...]] = None,
+             vary: Tuple[str, ...] = DEF_VARY) -> str:
+    '''
+    Request key of method, path, normalized query arguments and
+    vary headers.
+
+    :param args: `<tuple>` query arguments in key, None all arguments
+    :param vary: `<tuple>` request headers in key
+    '''
+    request = handler.request
+    names = sorted(request.query_arguments) if args is None else args
+    query = '&'.join(f'{name}={",".join(handler.get_query_arguments(name))}'
+                     for name in names)
+    headers = '|'.join(request.headers.get(name, '') for name in vary)
+    return f'{request.method}:{request.path}?{query}|{headers}'
+
+
+def cache_response(ttl: float,
+                   args: Optional[Tuple[str, ...]] = None,
+                   vary: Tuple[str, ...] = DEF_VARY,
+                   stale: float = 0,
+                   cache: Any = None,
+                   maxsize: int = 1024) -> Callable:
+    '''
+    Cache GET handler response, key is url path, query arguments and
+    vary headers. See ResponseCache.
+    '''
+    rcache = ResponseCache(ttl,
+                           args=args,
+                           vary=vary,
+                           stale=stale,
+                           cache=cache,
+                           maxsize=maxsize)
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        async def wrapper(self: tornado.web.RequestHandler, *args: Any,
+                          **kwargs: Any) -> Any:
+            key = rcache.make_key(self)
+            entry = await rcache.get(key)
+            if entry:
+                if rcache.is_fresh(entry) or entry.refreshing:
+                    output_response(self, entry)
+                    return None
+                # stale, this request refreshes, others get stale one
+                entry.refreshing = True
+            returned = rcache.capture(self, key)
+            try:
+                result = method(self, *args, **kwargs)
+                if asyncio.iscoroutine(result) or \
+                        isinstance(result, asyncio.Future):
+                    result = await result
+                returned()
+            finally:
+                if entry:
+                    entry.refreshing = False
+            return result
+
+        wrapper.cache = rcache
+        return wrapper
+
+    return decorator
+
+
+class SingleFlight:
+    def __init__(self,
+                 args: Optional[Tuple[str, ...]] = None,
+                 vary: Tuple[str, ...] = DEF_VARY,
+                 timeout: float = DEF_WAIT_TIMEOUT) -> None:
+        '''
+        :param args: `<tuple>` query arguments in key, None all arguments
+        :param vary: `<tuple>` request headers in key
+        :param timeout: `<float>` followers wait seconds, then compute
+        '''
+        self.args = args
+        self.vary = vary
+        self.timeout = timeout
+        # {key: future of CachedResponse}
+        self._flights = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def wait(self, key: str) -> Optional[CachedResponse]:
+        '''Wait in-progress response, None if no leader or timeout'''
+        future = self._flights.get(key)
+        if future is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(future),
+                                          self.timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def lead(self, handler: tornado.web.RequestHandler, key: str) -> None:
+        '''Current request computes, share response on finish'''
+        future = asyncio.get_event_loop().create_future()
+        self._flights[key] = future
+
+        def _share(entry: CachedResponse) -> None:
+            if self._flights.get(key) is future:
+                del self._flights[key]
+            if not future.done():
+                future.set_result(entry)
+
+        capture_response(handler, _share)
+
+
+def single_flight(args: Optional[Tuple[str, ...]] = None,
+                  vary: Tuple[str, ...] = DEF_VARY,
+                  timeout: float = DEF_WAIT_TIMEOUT) -> Callable:
+    '''
+    Concurrent identical requests(method, path, normalized arguments and
+    vary headers) wait one in-progress computation and share its
+    response bytes. See SingleFlight.
+    '''
+    flight = SingleFlight(args=args, vary=vary, timeout=timeout)
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        async def wrapper(self: tornado.web.RequestHandler, *args: Any,
+                          **kwargs: Any) -> Any:
+            key = make_key(self, flight.args, flight.vary)
+            entry = await flight.wait(key)
+            if entry:
+                output_response(self, entry)
+                return None
+            flight.lead(self, key)
+            result = method(self, *args, **kwargs)
+            if asyncio.iscoroutine(result) or \
+                    isinstance(result, asyncio.Future):
+                result = await result
+            return result
+
+        wrapper.flight = flight
+        return wrapper
+
+    return decorator
+
+
+def etag_version(source: Callable[[tornado.web.RequestHandler], Any],
+                 args: Optional[Tuple[str, ...]] = None,
+                 vary: Tuple[str, ...] = DEF_VARY) -> Callable:
+    '''
+    ETag from a cheap version source instead of hashing response body,
+    If-None-Match is checked before the handler runs, unchanged
+    resource returns 304 without database query or serialization.
+
+    :param source: `<callable>` source(handler) return version(or
+        awaitable), e.g: max(mtime) of model or redis counter
+    :param args: `<tuple>` query arguments in etag, None all arguments
+    :param vary: `<tuple>` request headers in etag
+    '''
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        async def wrapper(self: tornado.web.RequestHandler, *args_: Any,
+                          **kwargs: Any) -> Any:
+            version = source(self)
+            if asyncio.iscoroutine(version) or \
+                    isinstance(version, asyncio.Future):
+                version = await version
+            if version is not None:
+                key = f'{make_key(self, args, vary)}#{version}'
+                digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+                # weak, the body may be encoded differently
+                self.set_header('Etag', f'W/"{digest}"')
+                if self.check_etag_header():
+                    self.set_status(304)
+                    self.finish()
+                    return None
+            result = method(self, *args_, **kwargs)
+            if asyncio.iscoroutine(result) or \
+                    isinstance(result, asyncio.Future):
+                result = await result
+            return result
+
+        return wrapper
+
+    return decorator
@@ -1,11 +1,15 @@
 '''
 Base service class.
 '''
+import asyncio
+import threading
 import peewee
-from typing import Any, Union, Optional
+from typing import Any, Awaitable, Callable, Union, Optional
 from tweb.database.paginate import pager
 from tweb.exceptions import NotFoundError
 from tweb.utils import strings
+from tweb.utils.bloom import BloomFilter
+from tweb.utils.log import logger
 
 # Default page=1 and limit=20
 DEF_PAGE, DEF_LIMIT = 1, 20
@@ -13,6 +17,9 @@ IGNORE_TYPE = Union[None, str, list, tuple]
 ID_TYPE = Union[str, int]
 ORDER_TYPE = Union[str, tuple]
 NULL_VALUES = (None, '')
+TEXT_FIELDS = (peewee.CharField, peewee.TextField)
+# cached row field of NULL columns, hash fields can't tell NULL from ''
+NULLS_FIELD = '__nulls__'
 
 
 def st_filter(obj: peewee.Model, value: int) -> Any:
@@ -191,9 +198,259 @@ def fmt_data(datas: peewee.Model,
     return [data.get_dict(ignores) for data in datas]
 
 
+# serving event loop, recorded by _run
+_loop = None
+
+
+def _run(factory: Callable[[], Awaitable]) -> None:
+    '''
+    Run in background of the serving loop, or wait it in scripts. The
+    awaitable is created by factory on the loop thread.
+    '''
+    global _loop
+    try:
+        _loop = asyncio.get_running_loop()
+    except RuntimeError:
+        pass
+    else:
+        _schedule(factory)
+        return
+    if _loop is not None and _loop.is_running():
+        # called in a thread(e.g: run_in_executor), hand off to the loop
+        _loop.call_soon_threadsafe(_schedule, factory)
+        return
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError as err:
+        logger.error(f'Service cache skipped: {err}')
+        return
+    loop.run_until_complete(factory())
+
+
+def _schedule(factory: Callable[[], Awaitable]) -> None:
+    try:
+        future = asyncio.ensure_future(factory())
+    except Exception as err:
+        logger.error(f'Service cache error: {err}')
+        return
+    future.add_done_callback(_log_error)
+
+
+def _log_error(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception():
+        logger.error(f'Service cache error: {future.exception()}')
+
+
+def _cache_value(field: peewee.Field, value: str) -> Any:
+    '''Field value of string cached in redis hash'''
+    if value == '':
+        return None
+    if isinstance(field, peewee.BooleanField):
+        return value.lower() in ('true', '1')
+    return field.python_value(value)
+
+
 class BaseService(object):
-    def __init__(self, empty: peewee.Model) -> None:
+    '''
+    Read-through cache of find_by_id(get_or_404, find), set a DictCache
+    with in-process tier(required), update/updates/delete/save_or_update
+    invalidate it. Synchronous reads hit the in-process tier, afind_by_id
+    reads redis too. Rows filled from database expire in cache_ttl
+    seconds, it bounds a row filled by a read racing an update. Declare
+    DictCache converters of non-string fields(or msgpack serializer),
+    string values of other fields are parsed by the field. Both tiers
+    keep the record DictCache.get returns, __filters__ must not drop
+    columns, records missing columns are read from database.
+
+    usage::
+
+        class UserCache(DictCache):
+            cache = center_cache
+            __rdskey__ = 'user:{0}'
+            local = LRUCache(maxsize=10000, ttl=60)
+            pubsub = MyPubSub
+
+        user_service = BaseService(User, cache=UserCache)
+
+    Missing ids are cached by DictCache.__negative_ttl__, a Bloom filter
+    of primary keys answers ids certainly not exist from memory::
+
+        user_service = BaseService(User, cache=UserCache,
+                                   bloom=BloomFilter(capacity=1000000))
+        plugins.register(user_service.refresh_bloom, 600)
+
+    Only integer primary keys up to the max of the rebuild before the
+    last one are answered by the filter: rows of other workers(or created
+    outside save) and transactions in flight during a scan are committed
+    by the next scan, if transactions are shorter than the interval.
+    Greater ids and other primary keys(e.g: uuid) are always queried,
+    missing ones are cached by __negative_ttl__.
+    '''
+    # DictCache subclass of primary key reads, None disable
+    cache = None
+    # BloomFilter of primary keys, None disable
+    bloom = None
+    # seconds rows filled from database live in redis
+    cache_ttl: int = 3600
+
+    def __init__(self,
+                 empty: peewee.Model,
+                 cache: Any = None,
+                 bloom: BloomFilter = None,
+                 cache_ttl: int = None) -> None:
         self.empty = empty
+        if cache is not None:
+            assert cache.local is not None, \
+                f'{cache.__name__}.local is required by the service'
+            dropped = set(cache.__filters__ or ()) & set(empty._meta.fields)
+            assert not dropped, \
+                f'{cache.__name__}.__filters__ drop columns {sorted(dropped)}'
+            self.cache = cache
+        if bloom is not None:
+            self.bloom = bloom
+        if cache_ttl is not None:
+            self.cache_ttl = cache_ttl
+        # ids up to it are answered by the filter, None not trusted yet
+        self._bloom_max = None
+        # max integer primary key of the last rebuild
+        self._last_max = None
+        # ids saved during a rebuild, added to the new filter
+        self._bloom_pending = None
+        self._bloom_lock = threading.Lock()
+
+    def rebuild_bloom(self) -> int:
+        '''
+        Rebuild Bloom filter from primary keys of the table.
+
+        :return: `<int>` rows count
+        '''
+        bloom = BloomFilter(self.bloom.capacity, self.bloom.error_rate)
+        max_pk = 0
+        with self._bloom_lock:
+            self._bloom_pending = []
+        try:
+            query = self.empty.select(self.empty._meta.primary_key).tuples()
+            for pk, in query.iterator():
+                bloom.add(pk)
+                if isinstance(pk, int) and pk > max_pk:
+                    max_pk = pk
+        except Exception:
+            with self._bloom_lock:
+                self._bloom_pending = None
+            raise
+        with self._bloom_lock:
+            bloom.update(self._bloom_pending)
+            self._bloom_pending = None
+            # ids of the previous scan were in flight one interval at most
+            self.bloom, self._bloom_max, self._last_max = \
+                bloom, self._last_max, max_pk
+        logger.debug(f'Rebuilt {self.empty.__name__} bloom of {len(bloom)}')
+        return len(bloom)
+
+    async def refresh_bloom(self, interval: float = 600) -> None:
+        '''
+        Rebuild Bloom filter every interval seconds, plugin task. Ids are
+        answered by the filter from the second rebuild.
+        '''
+        loop = asyncio.get_event_loop()
+        while True:
+            try:
+                await loop.run_in_executor(None, self.rebuild_bloom)
+            except Exception as err:
+                logger.error(f'Rebuild bloom error: {err}')
+            await asyncio.sleep(interval)
+
+    def counter(self, interval: float = 5, max_pending: int = 10000) -> Any:
+        '''
+        Write-behind counter of columns, cached rows are invalidated on
+        flush, see tweb.counter.ModelCounter.
+
+        usage::
+
+            views = article_service.counter()
+            plugins.register(views.start)
+            views.incr(pk, 'views')
+        '''
+        from tweb.counter import ModelCounter
+        return ModelCounter(self.empty, interval, max_pending, service=self)
+
+    def may_exist(self, pk: ID_TYPE) -> bool:
+        '''False only if the primary key is certainly not in the table'''
+        if self.bloom is None or self._bloom_max is None:
+            return True
+        if not isinstance(self.empty._meta.primary_key, peewee.IntegerField):
+            # no order, rows created since the rebuild are unknown
+            return True
+        try:
+            # the filter holds integers, e.g: '5' of url is 5
+            value = int(pk)
+        except (TypeError, ValueError):
+            return True
+        return value > self._bloom_max or value in self.bloom
+
+    def _from_cache(self, data: dict) -> Optional[peewee.Model]:
+        '''Model of cached record, None if columns are missing'''
+        fields = self.empty._meta.fields
+        if not fields.keys() <= data.keys():
+            # e.g: partial DictCache.set, or columns added since filled
+            return None
+        nulls = data.get(NULLS_FIELD)
+        nulls = set(nulls.split(',')) if nulls else ()
+        row = {}
+        for name, field in fields.items():
+            value = data[name]
+            if name in nulls:
+                value = None
+            elif isinstance(value, str) and \
+                    not isinstance(field, TEXT_FIELDS):
+                value = _cache_value(field, value)
+            row[name] = value
+        model = self.empty(__no_default__=1, **row)
+        model._dirty.clear()
+        return model
+
+    def _fill_cache(self, pk: ID_TYPE, model: peewee.Model) -> None:
+        data = dict(model.__data__)
+        if not self.cache._binary():
+            data[NULLS_FIELD] = ','.join(
+                name for name, value in data.items() if value is None)
+        # the record a redis read gives, filtered and converted
+        self.cache._local_set(
+            self.cache._get_key(pk),
+            self.cache._get_convert(self.cache._readback(data)))
+        _run(lambda: self._fill_redis(pk, data))
+
+    async def _fill_redis(self, pk: ID_TYPE, data: dict) -> None:
+        # aredis is optional without cache
+        from tweb.cache import batch
+        await self.cache._ensure_generation()
+        # fresh database row, whole record, no invalidation message
+        await batch(
+            self.cache.cache,
+            self.cache._write_commands(self.cache._get_key(pk), data,
+                                       self.cache_ttl))
+
+    def invalidate(self, *pks: ID_TYPE) -> None:
+        '''Drop cached rows of the primary keys'''
+        if self.cache is None or not pks:
+            return
+        if self.cache.local is not None:
+            self.cache.local.delete(*[self.cache._get_key(pk) for pk in pks])
+        _run(lambda: self.cache.removes(*pks))
+
+    async def afind_by_id(self, pk: ID_TYPE) -> Optional[peewee.Model]:
+        '''find_by_id reading the in-process tier and redis'''
+        if not pk or self.cache is None:
+            return self.find_by_id(pk)
+        if not self.may_exist(pk):
+            return None
+        data = await self.cache.get(pk)
+        model = self._from_cache(data) if data else None
+        if model is not None:
+            return model
+        if not data and self.cache.is_missing(pk):
+            return None
+        return self._load(pk)
 
     def is_db_col(self, key):
         if hasattr(self.empty, key):
@@ -203,9 +460,26 @@ class BaseService(object):
         return False
 
     def find_by_id(self, pk: ID_TYPE) -> Optional[peewee.Model]:
-        if not pk:
+        if not pk or not self.may_exist(pk):
             return None
-        return self.empty.fetchone(self.empty._meta.primary_key == pk)
+        if self.cache is not None:
+            data = self.cache._local_get(self.cache._get_key(pk))
+            model = self._from_cache(data) if data else None
+            if model is not None:
+                return model
+            if not data and self.cache.is_missing(pk):
+                return None
+        return self._load(pk)
+
+    def _load(self, pk: ID_TYPE) -> Optional[peewee.Model]:
+        model = self.empty.fetchone(self.empty._meta.primary_key == pk)
+        if self.cache is not None:
+            if not model:
+                self.cache.mark_missing(pk)
+            elif self.cache.local is not None:
+                # synchronous reads never see redis without the local tier
+                self._fill_cache(pk, model)
+        return model
 
     def get_or_404(self, pk: ID_TYPE) -> Optional[peewee.Model]:
         data = self.find_by_id(pk)
@@ -240,17 +514,30 @@ class BaseService(object):
         :raise OperateError:
         :return: `<int>`
         '''
-        return self.empty.create(**cloumns)
+        model = self.empty.create(**cloumns)
+        if self.bloom is not None:
+            with self._bloom_lock:
+                self.bloom.add(model.get_id())
+                if self._bloom_pending is not None:
+                    self._bloom_pending.append(model.get_id())
+        if self.cache is not None and self.cache._misses is not None:
+            # drop missing marks of the id in every worker
+            self.invalidate(model.get_id())
+        return model
 
     def update(self, pk: ID_TYPE, **columns: Any) -> int:
-        return self.empty.update(**columns).where(
+        count = self.empty.update(**columns).where(
             self.empty.id == pk).execute()
+        self.invalidate(pk)
+        return count
 
     def updates(self, pks: list, **columns: Any) -> int:
         if not isinstance(pks, (list, tuple)):
             pks = [pks]
-        return self.empty.update(
+        count = self.empty.update(
             **columns).where(self.empty.id << pks).execute()
+        self.invalidate(*pks)
+        return count
 
     def save_or_update(self, columns: dict, pk: int = None) -> int:
         '''
@@ -270,7 +557,9 @@ class BaseService(object):
     def delete(self, ids: Union[int, str, list]) -> int:
         if not isinstance(ids, list):
             ids = [ids]
-        return self.empty.delete().where(self.empty.id << ids).execute()
+        count = self.empty.delete().where(self.empty.id << ids).execute()
+        self.invalidate(*ids)
+        return count
 
     def assert_exist(self, pks: Union[int, list, tuple]) -> None:
         '''
@@ -309,6 +598,21 @@ class BaseService(object):
     def count_field(self, field: str, value: Any) -> int:
         return self.count((getattr(self.empty, field) == value, ))
 
+    def version(self, field: str = 'mtime', query: tuple = None) -> str:
+        '''
+        Cheap data version, max(field) and count(rows), see
+        tweb.httpcache.etag_version.
+
+        :param field: `<str>` modify time column, default mtime
+        :param query: `<tuple>` query condition
+        :return: `<str>`
+        '''
+        data = self.empty.select(
+            peewee.fn.MAX(getattr(self.empty, field)),
+            peewee.fn.COUNT(self.empty._meta.primary_key))
+        max_value, count = self._where(data, query).tuples().get()
+        return f'{max_value}-{count}'
+
     def find_all(self,
                  query: tuple = None,
                  order: ORDER_TYPE = None,
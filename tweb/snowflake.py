@@ -0,0 +1,193 @@
+'''
+Snowflake unique id generator.
+
+64 bits id: 1 bit unused | 41 bits timestamp(ms) | 10 bits worker id
+| 12 bits sequence, ids are generated locally, in order, without
+collisions across workers and nodes if every worker has its own id.
+
+The default worker id is pid & 1023, only unique among the processes of
+one node whose pids differ in the low 10 bits. Lease the worker id from
+redis when workers of several nodes share ids(e.g: upload file names).
+
+usage::
+
+    from tweb.snowflake import snowflake
+    pk = snowflake.next_id()
+
+    # lease worker id from redis after fork, unique across nodes
+    cache = Cache(conf_prefix='center')
+    plugins.register(cache.initialize)
+    plugins.register(snowflake.lease, cache)
+'''
+import os
+import time
+import asyncio
+import threading
+from typing import Any, Optional, Tuple
+
+from tweb.utils.log import logger
+
+__all__ = ['Snowflake', 'snowflake']
+
+# 2020-01-01 00:00:00 UTC
+DEF_EPOCH = 1577836800000
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+# max tolerated clock moved backwards(ms), else raise error
+MAX_BACKWARDS = 5
+
+
+class Snowflake:
+    def __init__(self, worker_id: int = None, epoch: int = DEF_EPOCH):
+        '''
+        :param worker_id: `<int>` 0-1023, default pid based until leased
+        :param epoch: `<int>` custom epoch(ms)
+        '''
+        self._pid_based = worker_id is None
+        if worker_id is None:
+            worker_id = os.getpid() & MAX_WORKER_ID
+        assert 0 <= worker_id <= MAX_WORKER_ID, \
+            f'worker_id must be between 0 and {MAX_WORKER_ID}'
+        self.worker_id = worker_id
+        self.epoch = epoch
+        self._sequence = 0
+        self._last_ts = -1
+        self._lock = threading.Lock()
+        self._lease_key = None
+        self._lease_value = None
+        self._lease_task = None
+        # lease is lost, refuse to issue ids until leased again
+        self._lost = False
+        if self._pid_based and hasattr(os, 'register_at_fork'):
+            # forked workers must not share the parent's worker id
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self) -> None:
+        self._lock = threading.Lock()
+        if self._pid_based:
+            self.worker_id = os.getpid() & MAX_WORKER_ID
+        self._lease_key = None
+        self._lease_value = None
+        self._lease_task = None
+        self._lost = False
+
+    @staticmethod
+    def _now() -> int:
+        return int(time.time() * 1000)
+
+    def _wait_next(self, last_ts: int) -> int:
+        ts = self._now()
+        while ts <= last_ts:
+            time.sleep(0.0001)
+            ts = self._now()
+        return ts
+
+    def next_id(self) -> int:
+        with self._lock:
+            if self._lost:
+                raise RuntimeError(
+                    f'Snowflake worker id {self.worker_id} lease was lost')
+            ts = self._now()
+            if ts < self._last_ts:
+                if self._last_ts - ts > MAX_BACKWARDS:
+                    raise RuntimeError(
+                        f'Clock moved backwards {self._last_ts - ts}ms')
+                ts = self._wait_next(self._last_ts - 1)
+            if ts == self._last_ts:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    ts = self._wait_next(self._last_ts)
+            else:
+                self._sequence = 0
+            self._last_ts = ts
+            return ((ts - self.epoch) << (WORKER_BITS + SEQUENCE_BITS)) | \
+                (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    def next_ids(self, count: int) -> list:
+        return [self.next_id() for _ in range(count)]
+
+    def parse(self, id_: int) -> Tuple[int, int, int]:
+        '''
+        :return: `<tuple>` timestamp(ms), worker_id, sequence
+        '''
+        ts = (id_ >> (WORKER_BITS + SEQUENCE_BITS)) + self.epoch
+        worker_id = (id_ >> SEQUENCE_BITS) & MAX_WORKER_ID
+        return ts, worker_id, id_ & MAX_SEQUENCE
+
+    async def lease(self,
+                    cache: Any,
+                    prefix: str = 'snowflake:worker',
+                    ttl: int = 60) -> Optional[int]:
+        '''
+        Lease a free worker id from redis and keep it alive.
+
+        Call it after fork (e.g: plugins), each process gets its own id.
+        If the lease is lost(e.g: redis was unreachable over ttl), next_id
+        raises RuntimeError until a worker id is leased again.
+
+        :param cache: `<Cache>` redis cache
+        :param prefix: `<str>` redis key prefix
+        :param ttl: `<int>` lease seconds, renewed every ttl/3
+        :return: `<int>` worker id, None if no free id
+        '''
+        worker_id = await self._acquire(cache, prefix, ttl)
+        if worker_id is None:
+            logger.error('No free snowflake worker id, use pid based id')
+            return None
+        self._lease_task = asyncio.ensure_future(
+            self._renew(cache, prefix, ttl))
+        return worker_id
+
+    async def _acquire(self, cache: Any, prefix: str,
+                       ttl: int) -> Optional[int]:
+        value = f'{os.uname()[1]}:{os.getpid()}'
+        start = self.worker_id
+        for offset in range(MAX_WORKER_ID + 1):
+            worker_id = (start + offset) & MAX_WORKER_ID
+            key = f'{prefix}:{worker_id}'
+            if await cache.set(key, value, ex=ttl, nx=True):
+                with self._lock:
+                    self.worker_id = worker_id
+                    self._pid_based = False
+                    self._lost = False
+                self._lease_key = key
+                self._lease_value = value
+                logger.debug(f'Leased snowflake worker id {worker_id}')
+                return worker_id
+        return None
+
+    async def _renew(self, cache: Any, prefix: str, ttl: int) -> None:
+        while True:
+            await asyncio.sleep(max(ttl / 3, 1))
+            try:
+                if not self._lost:
+                    # expire only our own lease, the key may be expired
+                    # and leased by another process
+                    owner = await cache.get(self._lease_key)
+                    if isinstance(owner, bytes):
+                        owner = owner.decode('utf-8')
+                    if owner == self._lease_value and \
+                            await cache.expire(self._lease_key, ttl):
+                        continue
+                    logger.error(
+                        f'Snowflake worker lease {self._lease_key} was lost')
+                    with self._lock:
+                        self._lost = True
+                await self._acquire(cache, prefix, ttl)
+            except Exception as err:
+                logger.error(f'Renew snowflake worker lease error: {err}')
+
+    async def release(self, cache: Any) -> None:
+        '''Release leased worker id, e.g: atexit_register'''
+        if self._lease_task:
+            self._lease_task.cancel()
+            self._lease_task = None
+        if self._lease_key:
+            await cache.delete(self._lease_key)
+            self._lease_key = None
+            self._lease_value = None
+
+
+snowflake = Snowflake()
@@ -0,0 +1,175 @@
+'''
+In-memory static file handler.
+
+Static files are loaded at startup with precomputed gzip/brotli variants
+and content hash versions, requests cost no disk I/O or compression.
+
+usage::
+
+    from tweb.static import MemoryStaticHandler
+
+    server = HttpServer()
+    server.configure_static_handler(MemoryStaticHandler)
+    server.start(settings={'static_path': '/project/static'})
+
+    # handler or template, versioned url is cached immutable
+    self.static_url('js/app.js')  # /static/js/app.js?v=3f2a...
+'''
+import os
+import hashlib
+import datetime
+import mimetypes
+import threading
+from typing import Any, Dict, Optional
+import tornado.web
+
+from tweb.utils import compress
+from tweb.utils.log import logger
+
+__all__ = ['StaticAsset', 'MemoryStaticHandler']
+
+COMPRESS_TYPES = frozenset([
+    'application/javascript', 'application/json', 'application/xml',
+    'application/wasm', 'image/svg+xml', 'application/x-javascript'
+])
+# files over it are served from disk
+DEF_MAX_SIZE = 4 * 1024 * 1024
+# files less than it are not compressed
+DEF_MIN_SIZE = 256
+IMMUTABLE_AGE = 365 * 24 * 60 * 60
+
+
+class StaticAsset:
+    __slots__ = ('body', 'variants', 'version', 'content_type', 'modified')
+
+    def __init__(self, body: bytes, content_type: str, modified: float):
+        self.body = body
+        self.content_type = content_type
+        self.modified = modified
+        self.version = hashlib.md5(body).hexdigest()
+        # {encoding: compressed body}
+        self.variants: Dict[str, bytes] = {}
+
+    @staticmethod
+    def compressible(content_type: str) -> bool:
+        return content_type.startswith('text/') or \
+            content_type in COMPRESS_TYPES
+
+    def precompress(self, min_size: int = DEF_MIN_SIZE) -> None:
+        if len(self.body) < min_size or \
+                not self.compressible(self.content_type):
+            return
+        for encoding in compress.ENCODINGS:
+            level = 11 if encoding == 'br' else 9
+            data = compress.compress(self.body, encoding, level)
+            if len(data) < len(self.body):
+                self.variants[encoding] = data
+
+
+class MemoryStaticHandler(tornado.web.StaticFileHandler):
+    # {absolute path: StaticAsset}
+    _assets: Dict[str, StaticAsset] = {}
+    _loaded_roots: set = set()
+    _load_lock = threading.Lock()
+
+    @classmethod
+    def preload(cls,
+                root: str,
+                max_size: int = DEF_MAX_SIZE,
+                min_size: int = DEF_MIN_SIZE) -> int:
+        '''
+        Load static files to memory, call before fork to share pages.
+
+        :param root: `<str>` static path
+        :param max_size: `<int>` files over it are served from disk
+        :param min_size: `<int>` files less than it are not compressed
+        :return: `<int>` loaded files count
+        '''
+        root = os.path.abspath(root)
+        with cls._load_lock:
+            if root in cls._loaded_roots:
+                return 0
+            count = 0
+            for dirpath, _, filenames in os.walk(root):
+                for filename in filenames:
+                    abs_path = os.path.join(dirpath, filename)
+                    if os.path.getsize(abs_path) > max_size:
+                        continue
+                    with open(abs_path, 'rb') as _file:
+                        body = _file.read()
+                    mime_type, encoding = mimetypes.guess_type(abs_path)
+                    if encoding or not mime_type:
+                        content_type = 'application/octet-stream'
+                    else:
+                        content_type = mime_type
+                    asset = StaticAsset(body, content_type,
+                                        os.path.getmtime(abs_path))
+                    asset.precompress(min_size)
+                    cls._assets[abs_path] = asset
+                    count += 1
+            cls._loaded_roots.add(root)
+        logger.debug(f'Loaded {count} static files from {root}')
+        return count
+
+    @classmethod
+    def get_asset(cls, abs_path: str) -> Optional[StaticAsset]:
+        return cls._assets.get(abs_path)
+
+    @classmethod
+    def get_version(cls, settings: Dict[str, Any],
+                    path: str) -> Optional[str]:
+        root = settings['static_path']
+        if os.path.abspath(root) not in cls._loaded_roots:
+            # static_url may be called before the first static request
+            cls.preload(root)
+        abs_path = cls.get_absolute_path(root, path)
+        asset = cls._assets.get(abs_path)
+        if asset:
+            return asset.version
+        return super().get_version(settings, path)
+
+    def initialize(self, path: str, default_filename: str = None,
+                   **kwargs: Any) -> None:
+        super().initialize(path, default_filename, **kwargs)
+        if os.path.abspath(path) not in self._loaded_roots:
+            self.preload(path)
+
+    async def get(self, path: str, include_body: bool = True) -> None:
+        self.path = self.parse_url_path(path)
+        asset = self._assets.get(self.get_absolute_path(self.root, self.path))
+        if not asset or 'Range' in self.request.headers:
+            # not loaded(too large or added after startup) or partial
+            # content, read disk
+            await super().get(path, include_body=include_body)
+            return
+        encoding = compress.negotiate(
+            self.request.headers.get('Accept-Encoding'),
+            tuple(e for e in compress.ENCODINGS if e in asset.variants))
+        self.set_header('Content-Type', asset.content_type)
+        # one strong ETag per representation
+        if encoding:
+            self.set_header('Etag', f'"{asset.version}-{encoding}"')
+        else:
+            self.set_header('Etag', f'"{asset.version}"')
+        self.set_header(
+            'Last-Modified',
+            datetime.datetime.fromtimestamp(int(asset.modified),
+                                            datetime.timezone.utc))
+        if self.get_argument('v', None) == asset.version:
+            self.set_header('Cache-Control',
+                            f'public, max-age={IMMUTABLE_AGE}, immutable')
+        else:
+            self.set_header('Cache-Control', 'public, no-cache')
+        if asset.variants:
+            self.add_header('Vary', 'Accept-Encoding')
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+        body = asset.body
+        if encoding:
+            self.set_header('Content-Encoding', encoding)
+            body = asset.variants[encoding]
+        if include_body:
+            self.write(body)
+        else:
+            self.set_header('Content-Length', len(body))
@@ -1,9 +1,11 @@
 import os
+import asyncio
 from urllib.parse import urlparse
 from typing import Optional, Union
 from tornado import httputil
 
 from . import files
+from .snowflake import snowflake
 from tweb.utils.attr_util import AttrDict
 from tweb.utils import strings
 from tweb.utils.log import logger
@@ -12,6 +14,8 @@ from tweb.utils.log import logger
 MAX_IMG_PIXEL = (6000, 4000)
 # default upload video max pixel 1920x1080
 MAX_VIDEO_PIXEL = (3840, 2160)
+# default max number of files processed concurrently
+MAX_UPLOAD_WORKERS = 4
 
 
 class Upload:
@@ -34,6 +38,10 @@ class Upload:
         async def incr_number(cls) -> str:
             pass
         @classmethod
+        async def incr_numbers(cls, count: int) -> list:
+            # e.g: redis INCRBY, one round-trip for all files
+            pass
+        @classmethod
         async def get_value(cls, key_: str) -> Optional[str]:
             pass
 
@@ -43,8 +51,6 @@ class Upload:
         '/static',
         'access:url':
         'http://localhost:8888',
-        'upload:file:number':
-        1,
         'image:upload:path':
         os.path.join(strings.get_root_path(), 'upload', 'images'),
         'image:upload:max:size':
@@ -73,9 +79,23 @@ class Upload:
 
     @classmethod
     async def incr_number(cls) -> str:
-        '''Rewrite'''
-        cls.default_config['upload:file:number'] += 1
-        return f"{cls.default_config['upload:file:number']}"
+        '''Rewrite, default snowflake id.
+
+        Unique across nodes only if snowflake.lease is registered,
+        see tweb.snowflake.
+        '''
+        return f'{snowflake.next_id()}'
+
+    @classmethod
+    async def incr_numbers(cls, count: int) -> list:
+        '''Rewrite, allocate `count` numbers at once.
+
+        If incr_number is rewritten, default calls it `count` times,
+        rewrite it with a batch command (e.g: redis INCRBY) as well.
+        '''
+        if cls.incr_number.__func__ is Upload.incr_number.__func__:
+            return [f'{pk}' for pk in snowflake.next_ids(count)]
+        return [await cls.incr_number() for _ in range(count)]
 
     @classmethod
     async def get_value(cls, key_: str) -> Optional[str]:
@@ -154,7 +174,8 @@ class Upload:
             max_pixel: tuple = MAX_IMG_PIXEL,
             classify: str = 'tmp',
             fetchone: bool = True,
-            access_url: str = None) -> Optional[Union[dict, list]]:
+            access_url: str = None,
+            workers: int = MAX_UPLOAD_WORKERS) -> Optional[Union[dict, list]]:
         '''
         Upload image. If it returns an error message, it is
         internationalized content (message.po)
@@ -166,6 +187,7 @@ class Upload:
         :param fetchone: `<bool>` default get first file,
             if fetchone false return all
         :param access_url: `<str>` base access url
+        :param workers: `<int>` max files processed concurrently
         :return: `<AttrDict>`
             status(if status is False, only return message and status)
             origin_name
@@ -173,7 +195,6 @@ class Upload:
             access_path
             message(error message)
         '''
-        datas = []
         # upload_path: base_upload_url + classify,
         # eg. base url: /data/images
         # /data/images/users
@@ -185,30 +206,46 @@ class Upload:
             access_url = await cls.get_access_url()
         if fetchone:
             file_names = [file_names]
-        for idx, fname in enumerate(file_names):
+        for fname in file_names:
             suffix = files.get_file_suffix(fname)
             if suffix[1:].lower() not in fmt.split(','):
                 logger.warning('[%s]image format is not supported' % suffix)
                 return AttrDict(
                     dict(status=False,
                          message='Image format is not supported'))
-            number = await cls.incr_number()
-            new_name = '%s%s' % (strings.get_now_date(fmt='%Y%m%d%H%M%S'),
-                                 number.zfill(6))
-            file_path = files.upload(request,
-                                     name,
-                                     upload_path,
-                                     index=idx,
-                                     new_name=new_name)
-            image_pixel = files.get_image_pixel(file_path)
-            if max_pixel[0] < image_pixel[0] or max_pixel[1] < image_pixel[1]:
-                files.rm_file(file_path)
-                return AttrDict(
-                    dict(status=False, message='Image pixel is too large'))
-            if files.get_file_size(file_path) > max_size:
-                files.rm_file(file_path)
-                return AttrDict(
-                    dict(status=False, message='Image size is too large'))
+        # create once here, concurrent makedirs in files.upload would race
+        try:
+            os.makedirs(upload_path, exist_ok=True)
+        except OSError:
+            logger.error('Can not create upload path.')
+            return AttrDict(
+                dict(status=False, message='Can not create upload path'))
+        numbers = await cls.incr_numbers(len(file_names))
+        now = strings.get_now_date(fmt='%Y%m%d%H%M%S')
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(max(workers or 1, 1))
+
+        async def _save(idx: int, number: str) -> tuple:
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(
+                        None, cls._save_image, request, name, upload_path,
+                        idx, now + number.zfill(6), max_pixel, max_size)
+                except Exception as err:
+                    logger.error(f'Save image error: {err}')
+                    return None, 'Image upload failed'
+
+        results = await asyncio.gather(
+            *[_save(idx, number) for idx, number in enumerate(numbers)])
+        errors = [msg for _, msg in results if msg]
+        if errors:
+            # keep request atomic, remove the files already saved
+            for file_path, msg in results:
+                if not msg:
+                    files.rm_file(file_path)
+            return AttrDict(dict(status=False, message=errors[0]))
+        datas = []
+        for fname, (file_path, _) in zip(file_names, results):
             access_path = os.path.join(access_url, 'images', classify,
                                        os.path.basename(file_path))
             datas.append(
@@ -219,6 +256,37 @@ class Upload:
                          access_path=access_path)))
         return datas[0] if fetchone else datas
 
+    @staticmethod
+    def _save_image(request: httputil.HTTPServerRequest, name: str,
+                    upload_path: str, index: int, new_name: str,
+                    max_pixel: tuple, max_size: int) -> tuple:
+        '''Write and check one image, run in executor.
+
+        :return: `<tuple>` (file_path, error message or None)
+        '''
+        file_path = files.upload(request,
+                                 name,
+                                 upload_path,
+                                 index=index,
+                                 new_name=new_name)
+        if not file_path:
+            return None, 'Image upload failed'
+        try:
+            image_pixel = files.get_image_pixel(file_path)
+        except Exception as err:
+            logger.error(f'Read image error: {err}')
+            image_pixel = None
+        if not image_pixel:
+            files.rm_file(file_path)
+            return file_path, 'Image format is not supported'
+        if max_pixel[0] < image_pixel[0] or max_pixel[1] < image_pixel[1]:
+            files.rm_file(file_path)
+            return file_path, 'Image pixel is too large'
+        if files.get_file_size(file_path) > max_size:
+            files.rm_file(file_path)
+            return file_path, 'Image size is too large'
+        return file_path, None
+
     @classmethod
     async def upload_video(
             cls,
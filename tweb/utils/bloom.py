@@ -0,0 +1,61 @@
+'''
+Bloom filter, in-process set membership with false positives only.
+
+usage::
+
+    bloom = BloomFilter(capacity=1000000, error_rate=0.001)
+    bloom.update(range(100))
+    99 in bloom  # True
+    100 in bloom  # False(certainly), or True with error_rate
+'''
+import math
+import hashlib
+from typing import Any, Iterable
+
+__all__ = ['BloomFilter']
+
+
+class BloomFilter:
+    def __init__(self, capacity: int = 1000000,
+                 error_rate: float = 0.001) -> None:
+        '''
+        :param capacity: `<int>` expected items
+        :param error_rate: `<float>` false positive rate at capacity
+        '''
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits = max(
+            int(-capacity * math.log(error_rate) / (math.log(2)**2)), 8)
+        self.hashes = max(int(round(self.bits / capacity * math.log(2))), 1)
+        self._data = bytearray((self.bits + 7) // 8)
+        self._count = 0
+
+    def _positions(self, item: Any) -> Iterable[int]:
+        # double hashing, h1 + i * h2
+        digest = hashlib.blake2b(f'{item}'.encode('utf-8'),
+                                 digest_size=16).digest()
+        hash1 = int.from_bytes(digest[:8], 'little')
+        hash2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((hash1 + i * hash2) % self.bits for i in range(self.hashes))
+
+    def add(self, item: Any) -> None:
+        for pos in self._positions(item):
+            self._data[pos >> 3] |= 1 << (pos & 7)
+        self._count += 1
+
+    def update(self, items: Iterable[Any]) -> None:
+        for item in items:
+            self.add(item)
+
+    def clear(self) -> None:
+        self._data = bytearray(len(self._data))
+        self._count = 0
+
+    def __contains__(self, item: Any) -> bool:
+        data = self._data
+        return all(data[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+    def __len__(self) -> int:
+        '''Added items, duplicates are counted'''
+        return self._count
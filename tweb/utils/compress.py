@@ -0,0 +1,62 @@
+'''
+Response compression, gzip and brotli(if installed).
+'''
+import gzip
+from typing import Optional
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ['ENCODINGS', 'negotiate', 'compress']
+
+# server preference order
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip', )
+# default gzip level and brotli quality
+DEF_GZIP_LEVEL = 6
+DEF_BROTLI_QUALITY = 4
+
+
+def negotiate(accept_encoding: str,
+              encodings: tuple = ENCODINGS) -> Optional[str]:
+    '''
+    Choose content encoding from Accept-Encoding header.
+
+    :param accept_encoding: `<str>` e.g: gzip, deflate, br;q=0.9
+    :param encodings: `<tuple>` supported encodings, preference order
+    :return: `<str>` encoding or None(identity)
+    '''
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        qvalue = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                qvalue = float(params[2:])
+            except ValueError:
+                qvalue = 0.0
+        accepted[name.strip().lower()] = qvalue
+    best, best_q = None, 0.0
+    for encoding in encodings:
+        qvalue = accepted.get(encoding, accepted.get('*', 0.0))
+        if qvalue > best_q:
+            best, best_q = encoding, qvalue
+    return best
+
+
+def compress(data: bytes, encoding: str, level: int = None) -> bytes:
+    '''
+    :param data: `<bytes>`
+    :param encoding: `<str>` br or gzip
+    :param level: `<int>` gzip level(1-9) or brotli quality(0-11)
+    '''
+    if encoding == 'br':
+        quality = DEF_BROTLI_QUALITY if level is None else level
+        return brotli.compress(data, quality=quality)
+    if encoding == 'gzip':
+        level = DEF_GZIP_LEVEL if level is None else level
+        return gzip.compress(data, compresslevel=level)
+    raise ValueError(f'Unsupported content encoding: {encoding}')
@@ -1,4 +1,15 @@
-from typing import Any
+import uuid
+import decimal
+import datetime
+from typing import Any, Callable
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 try:
     import ujson as json
@@ -7,14 +18,106 @@ except ImportError:
     import json
     JDecodeError = json.decoder.JSONDecodeError
 
+__all__ = [
+    'JSON_BACKEND', 'JsonDecodeError', 'register_encoder', 'json_default',
+    'json_dumps', 'json_dumpb', 'json_loads', 'MSGPACK_TYPES',
+    'msgpack_dumpb', 'msgpack_loads'
+]
+
+JSON_BACKEND = 'orjson' if orjson else json.__name__
+DATETIME_FMT = '%Y-%m-%d %H:%M:%S'
+DATE_FMT = '%Y-%m-%d'
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+# {type: encoder}, see register_encoder
+_encoders = {}
+
 
 class JsonDecodeError(JDecodeError):
     pass
 
 
-def json_dumps(value: Any, sort_keys=None) -> str:
-    return json.dumps(value, sort_keys=sort_keys)
+def register_encoder(type_: type, encoder: Callable[[Any], Any]) -> None:
+    '''
+    Register json encoder of user defined type.
+
+    usage::
+
+        register_encoder(Point, lambda obj: [obj.x, obj.y])
+
+    :param type_: `<type>` value type
+    :param encoder: `<callable>` return json serializable value
+    '''
+    _encoders[type_] = encoder
+
+
+def json_default(obj: Any) -> Any:
+    '''
+    Encode types not supported by json backend, datetime, date,
+    time, Decimal, UUID, bytes, set and peewee model(get_dict).
+    '''
+    encoder = _encoders.get(type(obj))
+    if encoder:
+        return encoder(obj)
+    if isinstance(obj, datetime.datetime):
+        return obj.strftime(DATETIME_FMT)
+    if isinstance(obj, datetime.date):
+        return obj.strftime(DATE_FMT)
+    if isinstance(obj, (datetime.time, datetime.timedelta, uuid.UUID)):
+        return str(obj)
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if hasattr(obj, 'get_dict'):
+        return obj.get_dict()
+    for type_, encoder in _encoders.items():
+        if isinstance(obj, type_):
+            return encoder(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} '
+                    'is not JSON serializable')
+
+
+def _support_default() -> bool:
+    try:
+        json.dumps(None, default=str)
+    except TypeError:
+        # ujson < 5.0
+        return False
+    return True
+
+
+if orjson:
+    _OPTION = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+
+    def json_dumpb(value: Any, sort_keys=None) -> bytes:
+        option = _OPTION | orjson.OPT_SORT_KEYS if sort_keys else _OPTION
+        return orjson.dumps(value, default=json_default, option=option)
+
+    def json_dumps(value: Any, sort_keys=None) -> str:
+        return json_dumpb(value, sort_keys=sort_keys).decode('utf-8')
+
+    def json_loads(value: Any) -> Any:
+        return orjson.loads(value)
+
+else:
+    _KWARGS = {'default': json_default} if _support_default() else {}
+
+    def json_dumps(value: Any, sort_keys=None) -> str:
+        return json.dumps(value, sort_keys=sort_keys, **_KWARGS)
+
+    def json_dumpb(value: Any, sort_keys=None) -> bytes:
+        return json_dumps(value, sort_keys=sort_keys).encode('utf-8')
+
+    def json_loads(value: Any) -> Any:
+        return json.loads(value)
+
+
+def msgpack_dumpb(value: Any) -> bytes:
+    '''Pack value to MessagePack, types encoded same as json'''
+    return msgpack.packb(value, default=json_default, use_bin_type=True)
 
 
-def json_loads(value: Any) -> Any:
-    return json.loads(value)
+def msgpack_loads(value: bytes) -> Any:
+    return msgpack.unpackb(value, raw=False, strict_map_key=False)
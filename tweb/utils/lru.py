@@ -0,0 +1,81 @@
+'''
+In-process LRU cache with TTL.
+
+usage::
+
+    lru = LRUCache(maxsize=1024, ttl=10)
+    lru.set('user:1', data)
+    data = lru.get('user:1')
+'''
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator, Optional
+
+__all__ = ['LRUCache']
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024, ttl: float = None) -> None:
+        '''
+        :param maxsize: `<int>` max items, least recently used is evicted
+        :param ttl: `<float>` default seconds to live, None no expire
+        '''
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # {key: (expire_at, value)}
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key, _MISSING)
+            if item is _MISSING:
+                return default
+            expire_at, value = item
+            if expire_at is not None and expire_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None) -> None:
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def ttl_of(self, key: Hashable) -> Optional[float]:
+        '''Return remaining seconds, None if missing or no expire'''
+        with self._lock:
+            item = self._data.get(key)
+            if not item or item[0] is None:
+                return None
+            return max(item[0] - time.monotonic(), 0)
+
+    def delete(self, *keys: Hashable) -> int:
+        count = 0
+        with self._lock:
+            for key in keys:
+                if self._data.pop(key, _MISSING) is not _MISSING:
+                    count += 1
+        return count
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def keys(self) -> Iterator[Hashable]:
+        with self._lock:
+            return iter(list(self._data.keys()))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
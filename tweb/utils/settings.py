@@ -75,6 +75,13 @@ def default_settings(debug: bool,
         'cookie_secret': cookie_secret,
         'debug': debug,
         'login_url': '/login',
-        'xsrf_cookies': False
+        'xsrf_cookies': False,
+        # json response compression, see BaseHandler.finish_json
+        'compress_json': True,
+        'compress_min_size': 1024,
+        'compress_level': 6,
+        'brotli_quality': 4,
+        # compress in thread pool if body size is over it
+        'compress_thread_size': 256 * 1024
     }
     return data
@@ -0,0 +1,412 @@
+'''
+Shared memory cache of forked workers.
+
+Fixed-size hash table in an anonymous shared mmap, create it before fork
+and every worker reads and writes the same memory. Keys are hashed into
+buckets of `probe` slots, a bucket is guarded by one of `shards` process
+locks; an expired slot is reused first, else the least recently used
+slot of the bucket is evicted.
+
+usage::
+
+    shm = SharedMemoryCache(slots=65536, slot_size=512)
+    shm.set('key', 'value', ex=60)
+    shm.get('key')
+'''
+import mmap
+import time
+import struct
+import hashlib
+import multiprocessing
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, Union
+
+from tweb.utils.escape import json_dumps, json_loads
+
+__all__ = ['SharedMemoryCache', 'AsyncSharedMemoryCache']
+
+# key hash, expire at, last access, value length, key length, type
+_HEADER = struct.Struct('<QddIHBx')
+_EMPTY, _STR, _HASH, _BYTES = 0, 1, 2, 3
+
+
+class SharedMemoryCache:
+    def __init__(self,
+                 slots: int = 65536,
+                 slot_size: int = 512,
+                 probe: int = 8,
+                 shards: int = 64) -> None:
+        '''
+        :param slots: `<int>` max items, memory is slots * slot_size
+        :param slot_size: `<int>` bytes of header, key and value
+        :param probe: `<int>` slots per bucket
+        :param shards: `<int>` process locks
+        '''
+        assert slot_size > _HEADER.size, 'slot_size is too small'
+        self.probe = probe
+        self.buckets = max(slots // probe, 1)
+        self.slots = self.buckets * probe
+        self.slot_size = slot_size
+        self._mem = mmap.mmap(-1, self.slots * slot_size, mmap.MAP_SHARED)
+        self._locks = [multiprocessing.Lock() for _ in range(shards)]
+
+    @staticmethod
+    def _hash(key: bytes) -> int:
+        return int.from_bytes(
+            hashlib.blake2b(key, digest_size=8).digest(), 'little')
+
+    def _bucket(self, key: bytes) -> Tuple[int, int, Any]:
+        khash = self._hash(key)
+        bucket = khash % self.buckets
+        return khash, bucket, self._locks[bucket % len(self._locks)]
+
+    def _header(self, slot: int) -> tuple:
+        return _HEADER.unpack_from(self._mem, slot * self.slot_size)
+
+    def _slot_iter(self, bucket: int) -> Iterator[int]:
+        return iter(range(bucket * self.probe, (bucket + 1) * self.probe))
+
+    def _find(self, key: bytes, khash: int, bucket: int,
+              now: float) -> Optional[int]:
+        for slot in self._slot_iter(bucket):
+            _hash, expire_at, _, _, klen, _type = self._header(slot)
+            if _type == _EMPTY or _hash != khash:
+                continue
+            offset = slot * self.slot_size + _HEADER.size
+            if self._mem[offset:offset + klen] != key:
+                continue
+            if expire_at and expire_at <= now:
+                self._clear(slot)
+                return None
+            return slot
+        return None
+
+    def _clear(self, slot: int) -> None:
+        _HEADER.pack_into(self._mem, slot * self.slot_size, 0, 0, 0, 0, 0,
+                          _EMPTY)
+
+    def _free_slot(self, bucket: int, now: float) -> int:
+        victim, oldest = None, None
+        for slot in self._slot_iter(bucket):
+            _, expire_at, access, _, _, _type = self._header(slot)
+            if _type == _EMPTY or (expire_at and expire_at <= now):
+                return slot
+            if oldest is None or access < oldest:
+                victim, oldest = slot, access
+        return victim
+
+    def _read(self, slot: int, now: float) -> Tuple[int, bytes, float]:
+        khash, expire_at, _, vlen, klen, _type = self._header(slot)
+        base = slot * self.slot_size
+        offset = base + _HEADER.size + klen
+        value = self._mem[offset:offset + vlen]
+        _HEADER.pack_into(self._mem, base, khash, expire_at, now, vlen, klen,
+                          _type)
+        return _type, value, expire_at
+
+    def _write(self, slot: int, key: bytes, khash: int, value: bytes,
+               _type: int, expire_at: float, now: float) -> None:
+        if _HEADER.size + len(key) + len(value) > self.slot_size:
+            raise ValueError(f'Value of {key!r} is over slot size '
+                             f'{self.slot_size}')
+        base = slot * self.slot_size
+        offset = base + _HEADER.size
+        self._mem[offset:offset + len(key)] = key
+        offset += len(key)
+        self._mem[offset:offset + len(value)] = value
+        _HEADER.pack_into(self._mem, base, khash, expire_at, now, len(value),
+                          len(key), _type)
+
+    @staticmethod
+    def _expire_at(now: float, ex: float = None, px: float = None) -> float:
+        if ex:
+            return now + ex
+        if px:
+            return now + px / 1000
+        return 0
+
+    def _lookup(self, key: str) -> Tuple[int, Optional[bytes]]:
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            if slot is None:
+                return _EMPTY, None
+            vtype, value, _ = self._read(slot, now)
+        return vtype, value
+
+    def _get(self, key: str, _type: int) -> Optional[bytes]:
+        vtype, value = self._lookup(key)
+        return value if vtype == _type else None
+
+    def _put(self,
+             key: str,
+             value: bytes,
+             _type: int,
+             expire_at: float = 0,
+             nx: bool = False,
+             xx: bool = False) -> bool:
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            if (nx and slot is not None) or (xx and slot is None):
+                return False
+            if slot is None:
+                slot = self._free_slot(bucket, now)
+            self._write(slot, bkey, khash, value, _type, expire_at, now)
+        return True
+
+    def get(self, key: str) -> Optional[Union[str, bytes]]:
+        '''str value, bytes if it was set by bytes'''
+        vtype, value = self._lookup(key)
+        if vtype == _BYTES:
+            return value
+        return value.decode('utf-8') if vtype == _STR else None
+
+    def set(self,
+            key: str,
+            value: Any,
+            ex: float = None,
+            px: float = None,
+            nx: bool = False,
+            xx: bool = False) -> bool:
+        now = time.time()
+        if isinstance(value, bytes):
+            value, _type = value, _BYTES
+        else:
+            value, _type = f'{value}'.encode('utf-8'), _STR
+        return self._put(key,
+                         value,
+                         _type,
+                         self._expire_at(now, ex, px),
+                         nx=nx,
+                         xx=xx)
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            value, expire_at = 0, 0
+            if slot is not None:
+                vtype, data, expire_at = self._read(slot, now)
+                if vtype != _STR:
+                    raise TypeError(f'Value of {key} is not a string')
+                value = int(data)
+            else:
+                slot = self._free_slot(bucket, now)
+            value += amount
+            self._write(slot, bkey, khash, f'{value}'.encode('utf-8'), _STR,
+                        expire_at, now)
+        return value
+
+    def update(self,
+               key: str,
+               func: Callable[[Optional[bytes]], Tuple[Any, Optional[bytes]]],
+               ex: float = None) -> Any:
+        '''
+        Atomic read-modify-write of a bytes value under the bucket lock.
+
+        :param func: `<callable>` func(old bytes or None) return
+            (result, new bytes), new None deletes the key
+        :param ex: `<float>` expire seconds of the new value
+        :return: result of func
+        '''
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            old = None
+            if slot is not None:
+                vtype, value, _ = self._read(slot, now)
+                if vtype == _BYTES:
+                    old = value
+            result, value = func(old)
+            if value is None:
+                if slot is not None:
+                    self._clear(slot)
+                return result
+            if slot is None:
+                slot = self._free_slot(bucket, now)
+            self._write(slot, bkey, khash, value, _BYTES,
+                        self._expire_at(now, ex), now)
+        return result
+
+    def hgetall(self, key: str) -> Dict[str, str]:
+        value = self._get(key, _HASH)
+        return json_loads(value) if value else {}
+
+    def hmset(self, key: str, mapping: dict) -> bool:
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            data, expire_at = {}, 0
+            if slot is not None:
+                vtype, value, expire_at = self._read(slot, now)
+                if vtype == _HASH:
+                    data = json_loads(value)
+            else:
+                slot = self._free_slot(bucket, now)
+            data.update({k: f'{v}' for k, v in mapping.items()})
+            self._write(slot, bkey, khash, json_dumps(data).encode('utf-8'),
+                        _HASH, expire_at, now)
+        return True
+
+    def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            data, expire_at = {}, 0
+            if slot is not None:
+                vtype, value, expire_at = self._read(slot, now)
+                if vtype == _HASH:
+                    data = json_loads(value)
+            else:
+                slot = self._free_slot(bucket, now)
+            result = int(data.get(field, 0)) + amount
+            data[field] = f'{result}'
+            self._write(slot, bkey, khash, json_dumps(data).encode('utf-8'),
+                        _HASH, expire_at, now)
+        return result
+
+    def hdel(self, key: str, *fields: str) -> int:
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            if slot is None:
+                return 0
+            vtype, value, expire_at = self._read(slot, now)
+            if vtype != _HASH:
+                return 0
+            data = json_loads(value)
+            count = sum(1 for field in fields
+                        if data.pop(field, None) is not None)
+            if not data:
+                self._clear(slot)
+            else:
+                self._write(slot, bkey, khash,
+                            json_dumps(data).encode('utf-8'), _HASH,
+                            expire_at, now)
+        return count
+
+    def exists(self, key: str) -> bool:
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        with lock:
+            return self._find(bkey, khash, bucket, time.time()) is not None
+
+    def delete(self, *keys: str) -> int:
+        count = 0
+        for key in keys:
+            bkey = key.encode('utf-8')
+            khash, bucket, lock = self._bucket(bkey)
+            with lock:
+                slot = self._find(bkey, khash, bucket, time.time())
+                if slot is not None:
+                    self._clear(slot)
+                    count += 1
+        return count
+
+    def expire(self, key: str, seconds: float) -> bool:
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            if slot is None:
+                return False
+            _hash, _, access, vlen, klen, _type = self._header(slot)
+            _HEADER.pack_into(self._mem, slot * self.slot_size, _hash,
+                              now + seconds, access, vlen, klen, _type)
+        return True
+
+    def ttl(self, key: str) -> int:
+        '''Redis like, -2 not exists, -1 no expire'''
+        bkey = key.encode('utf-8')
+        khash, bucket, lock = self._bucket(bkey)
+        now = time.time()
+        with lock:
+            slot = self._find(bkey, khash, bucket, now)
+            if slot is None:
+                return -2
+            expire_at = self._header(slot)[1]
+        return int(expire_at - now) if expire_at else -1
+
+    def flushdb(self) -> bool:
+        for lock in self._locks:
+            lock.acquire()
+        try:
+            self._mem[:] = b'\x00' * len(self._mem)
+        finally:
+            for lock in self._locks:
+                lock.release()
+        return True
+
+
+class AsyncSharedMemoryCache(SharedMemoryCache):
+    '''
+    Awaitable API same as the redis client, used by Cache(model='shm').
+    '''
+    def __init__(self,
+                 slots: int = 65536,
+                 slot_size: int = 512,
+                 probe: int = 8,
+                 shards: int = 64,
+                 **kwargs: Any) -> None:
+        # redis connection kwargs(e.g: decode_responses) are ignored
+        super().__init__(slots, slot_size, probe, shards)
+
+    async def get(self, key: str) -> Optional[Union[str, bytes]]:
+        return super().get(key)
+
+    async def set(self, key: str, value: Any, ex: float = None,
+                  px: float = None, nx: bool = False,
+                  xx: bool = False) -> bool:
+        return super().set(key, value, ex=ex, px=px, nx=nx, xx=xx)
+
+    async def incr(self, key: str, amount: int = 1) -> int:
+        return super().incr(key, amount)
+
+    async def update(self,
+                     key: str,
+                     func: Callable[[Optional[bytes]], Tuple[Any,
+                                                             Optional[bytes]]],
+                     ex: float = None) -> Any:
+        return super().update(key, func, ex=ex)
+
+    async def hgetall(self, key: str) -> Dict[str, str]:
+        return super().hgetall(key)
+
+    async def hmset(self, key: str, mapping: dict) -> bool:
+        return super().hmset(key, mapping)
+
+    async def hincrby(self, key: str, field: str, amount: int = 1) -> int:
+        return super().hincrby(key, field, amount)
+
+    async def hdel(self, key: str, *fields: str) -> int:
+        return super().hdel(key, *fields)
+
+    async def exists(self, key: str) -> bool:
+        return super().exists(key)
+
+    async def delete(self, *keys: str) -> int:
+        return super().delete(*keys)
+
+    async def expire(self, key: str, seconds: float) -> bool:
+        return super().expire(key, seconds)
+
+    async def ttl(self, key: str) -> int:
+        return super().ttl(key)
+
+    async def flushdb(self) -> bool:
+        return super().flushdb()
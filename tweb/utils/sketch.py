@@ -0,0 +1,52 @@
+'''
+Count-min sketch, approximate frequency of keys in fixed memory.
+
+usage::
+
+    sketch = CountMinSketch(width=2048, depth=4)
+    sketch.add('user:1')  # estimate after add
+    sketch.estimate('user:1')
+    # halve counts, old accesses fade out
+    sketch.decay()
+'''
+from array import array
+from typing import Hashable
+
+__all__ = ['CountMinSketch']
+
+
+class CountMinSketch:
+    def __init__(self, width: int = 2048, depth: int = 4) -> None:
+        '''
+        :param width: `<int>` counters of one row, error is about
+            total count * e / width
+        :param depth: `<int>` rows, error probability is about e ** -depth
+        '''
+        self.width = width
+        self.depth = depth
+        self._rows = [array('L', [0]) * width for _ in range(depth)]
+
+    def _indexes(self, key: Hashable) -> list:
+        # per process hash randomization is fine, counts are per worker
+        return [hash((row, key)) % self.width for row in range(self.depth)]
+
+    def add(self, key: Hashable, count: int = 1) -> int:
+        estimate = None
+        for row, index in zip(self._rows, self._indexes(key)):
+            row[index] += count
+            if estimate is None or row[index] < estimate:
+                estimate = row[index]
+        return estimate
+
+    def estimate(self, key: Hashable) -> int:
+        return min(
+            row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def decay(self) -> None:
+        for row in self._rows:
+            for index, value in enumerate(row):
+                if value:
+                    row[index] = value >> 1
+
+    def clear(self) -> None:
+        self._rows = [array('L', [0]) * self.width for _ in range(self.depth)]
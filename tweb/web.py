@@ -4,7 +4,6 @@ import socket
 import asyncio
 import time
 import types
-import threading
 from functools import partial
 from collections import OrderedDict
 import signal as signal
@@ -71,6 +70,8 @@ class HttpServer:
         self.conf = None
         # e.g: val = [conn.closed,(True,),{...}]
         self._atexit_callbacks = OrderedDict()
+        self._exiting = False
+        self._forked = False
         self._init_options(options)
         self._init_config()
 
@@ -183,34 +184,31 @@ class HttpServer:
     def _atexit_call(self):
         if not self._atexit_callbacks:
             return
-        loop = asyncio.new_event_loop()
-        loop_thread = threading.Thread(
-            target=self._start_thread_loop, args=(loop,))
-        loop_thread.setDaemon(True)
-        loop_thread.start()
+        # the serving loop is stopped, coroutines run on it, connections
+        # of it(e.g: aredis) can not be used by other loops
+        loop = IOLoop.current().asyncio_loop
         for _, callable_ in self._atexit_callbacks.items():
             callback, args, kwargs = callable_
             func_ = callback(*args, **kwargs)
             if isinstance(func_, types.CoroutineType):
-                future = asyncio.run_coroutine_threadsafe(func_, loop)
-                future.result()
-
-    @staticmethod
-    def _start_thread_loop(loop):
-        asyncio.set_event_loop(loop)
-        loop.run_forever()
+                loop.run_until_complete(func_)
 
     def _atexit_signal(self, signalnum, frame):
         # received signal, stop server
         if signalnum != signal.SIGHUP:
             self.logger.error(
                 f'Received system input signal: {signalnum}, closed server.')
-            try:
-                self._atexit_call()
-            except (Exception, RuntimeError):
-                pass
-            IOLoop.current().stop()
-            sys.exit(1)
+            if self._forked and tornado.process.task_id() is None:
+                # master of fork_processes waits children, no serving loop
+                try:
+                    self._atexit_call()
+                except (Exception, RuntimeError):
+                    pass
+                sys.exit(1)
+            # callbacks run after the serving loop stopped
+            self._exiting = True
+            loop = IOLoop.current()
+            loop.asyncio_loop.call_soon_threadsafe(loop.stop)
         else:
             SignalHandler.restart()
 
@@ -295,6 +293,7 @@ class HttpServer:
         else:
             sockets = tornado.netutil.bind_sockets(self._port,
                                                    address=self.address)
+            self._forked = True
             tornado.process.fork_processes(proc)
             server.add_sockets(sockets)
         self.logger.info(f'Running on: http://localhost:{self._port}')
@@ -312,6 +311,10 @@ class HttpServer:
         self.logger.info(f"Debug mode: {settings['debug']}")
         self.logger.info(f'Archive log: {self.logger.is_archive}')
         self.application = Application(modules, **settings)
+        static_handler = settings.get('static_handler_class')
+        if settings.get('static_path') and hasattr(static_handler, 'preload'):
+            # load static files before fork, shared by workers
+            static_handler.preload(settings['static_path'])
         return self.application
 
     def initialize_tasks(self, tasks: Union[list] = None) -> None:
@@ -348,3 +351,10 @@ class HttpServer:
         self.configure_http_server()
         self.initialize_tasks(tasks)
         IOLoop.current().start()
+        if self._exiting:
+            try:
+                self._atexit_call()
+            except (Exception, RuntimeError):
+                pass
+            # fork_processes respawns workers exiting non-zero
+            sys.exit(0 if tornado.process.task_id() is not None else 1)